@@ -1,11 +1,13 @@
 # distutils: language=c++
 
 from random import uniform
+import threading
 import numpy as np
 from time import time
 
 from libcpp cimport bool
-from libc.stdlib cimport malloc, free
+from libc.stdint cimport uint8_t
+from libcpp.vector cimport vector
 
 cdef extern from "astar.cpp":
     pass
@@ -13,7 +15,7 @@ cdef extern from "astar.cpp":
 cdef extern from "astar_multi.cpp":
     pass
 
-cdef extern from "astar.h":
+cdef extern from "search.h":
     struct Point:
       int x0
       int x1
@@ -21,44 +23,197 @@ cdef extern from "astar.h":
     
     struct AstarResult:
       int path_length
-      Point* path
-     
-    cppclass Astar:
-        Astar(float*** cm, int d[3], float base_intensity)
-        AstarResult find_path_3d(Point& start, Point& end, bool is_soma)
+      vector[Point] path
+      long nodes_expanded
+      int status
+      float cost
+
+    cppclass SearchState:
+        void release()
+        size_t bytes()
+        void settled_costs(float* out)
+
+    cppclass CancelFlag:
+        void cancel()
+        void reset()
+        bool is_cancelled()
+
+    struct SearchLimits:
+        long max_nodes
+        double max_seconds
+        const CancelFlag* cancel
+        bool partial
+
+cdef extern from "astar.h":
+    cppclass Astar[T]:
+        Astar(const T* cm, long strides[4], int d[3], float base_intensity)
+        void set_mask(const uint8_t* mask, long strides[3])
+        void set_limits(SearchLimits& limits)
+        void set_connectivity(int connectivity, float spacing[3])
+        AstarResult find_path_3d(Point& start, Point& end, bool is_soma, SearchState& state) except + nogil
+        AstarResult find_path_3d_bidirectional(Point& start, Point& end, bool is_soma, SearchState& forward, SearchState& backward) except + nogil
+        AstarResult find_paths_3d(Point& start, vector[Point]& targets, bool is_soma, SearchState& state, vector[AstarResult]& paths) except + nogil
 
 cdef extern from "astar_multi.h":     
-    cppclass AstarMulti:
-        AstarMulti(float**** cm, int d[3], float* base_intensity)
-        AstarResult find_path_3d(Point& start, Point& end, bool is_soma)
+    cppclass AstarMulti[T]:
+        AstarMulti(const T* cm, long strides[4], int d[3], float* base_intensity)
+        void set_mask(const uint8_t* mask, long strides[3])
+        void set_limits(SearchLimits& limits)
+        void set_connectivity(int connectivity, float spacing[3])
+        AstarResult find_path_3d(Point& start, Point& end, bool is_soma, SearchState& state) except + nogil
+        AstarResult find_path_3d_bidirectional(Point& start, Point& end, bool is_soma, SearchState& forward, SearchState& backward) except + nogil
+        AstarResult find_paths_3d(Point& start, vector[Point]& targets, bool is_soma, SearchState& state, vector[AstarResult]& paths) except + nogil
+
+cdef extern from "astar_cost.h":
+    cppclass AstarCost:
+        AstarCost(const float* cost, long strides[4], int d[3], float lowest)
+        void set_mask(const uint8_t* mask, long strides[3])
+        void set_limits(SearchLimits& limits)
+        void set_connectivity(int connectivity, float spacing[3])
+        AstarResult find_path_3d(Point& start, Point& end, bool is_soma, SearchState& state) except + nogil
+        AstarResult find_path_3d_bidirectional(Point& start, Point& end, bool is_soma, SearchState& forward, SearchState& backward) except + nogil
+        AstarResult find_paths_3d(Point& start, vector[Point]& targets, bool is_soma, SearchState& state, vector[AstarResult]& paths) except + nogil
+
+# Voxel types the engine reads in place, anything else is converted to float32 first
+ctypedef fused voxel_t:
+    unsigned short
+    float
+
+
+cdef class SearchBuffers:
+    """Per voxel search state (predecessor, cost, closed flag) reused across traces
+
+    The buffers are sized by the box of the last search and only reallocated
+    when the box size changes, so repeated traces of similar length do not
+    allocate at all. Searches run without the GIL, so a buffer must not be
+    shared by concurrent searches.
+    """
+    cdef SearchState* state
+    cdef SearchState* backward  # second tree of bidirectional searches
+
+    def __cinit__(self):
+        self.state = new SearchState()
+        self.backward = new SearchState()
+
+    def __dealloc__(self):
+        del self.state
+        del self.backward
+
+    def release(self):
+        """Free the buffers now instead of when this object is collected"""
+        self.state.release()
+        self.backward.release()
+
+    @property
+    def nbytes(self):
+        return self.state.bytes() + self.backward.bytes()
+
+    def distances(self, shape):
+        """Cost from the start of every voxel settled by the last one-to-many search of a `shape` box"""
+        cdef float[:, :, ::1] out = np.empty(shape, dtype=np.float32)
+        self.state.settled_costs(&out[0, 0, 0])
+        return out.base
+
+
+SEARCH_STATUS = ("found", "not_found", "node_limit", "time_limit", "cancelled")
+"""Outcome of a search, indexed by the engine's SearchStatus"""
+
+
+cdef class CancelToken:
+    """Stops the searches it is passed to when `cancel()` is called from any thread"""
+    cdef CancelFlag flag
+
+    def cancel(self):
+        self.flag.cancel()
+
+    def reset(self):
+        self.flag.reset()
+
+    @property
+    def cancelled(self):
+        return self.flag.is_cancelled()
+
+
+_local = threading.local()
+
+
+def thread_search_buffers():
+    """Search buffers owned by the calling thread"""
+    if not hasattr(_local, "buffers"):
+        _local.buffers = SearchBuffers()
+    return _local.buffers
 
 
 class AstarWrapper():    
-    def __init__(self, is_soma=False, xy_extension=21, z_extension=7, tracing_sensitivity=5, is_multi=False):
+    def __init__(self, is_soma=False, xy_extension=21, z_extension=7, tracing_sensitivity=5, is_multi=False, bidirectional=False, max_nodes=0, max_seconds=0, partial=False, connectivity=6, spacing=None):
+        """
+        Args:
+            connectivity: 6, 18 or 26 neighbours per voxel
+            spacing: voxel size along x, y, z (e.g. the dataset resolution),
+                steps are weighted by their physical length. Isotropic if None
+            max_nodes: stop after expanding this many voxels, 0 for no limit
+            max_seconds: stop after this much wall time, 0 for no limit
+            partial: when stopped by a limit or cancelled, return the path to
+                the expanded voxel closest to the end instead of no path
+        """
         self.is_soma = is_soma
+        self.bidirectional = bidirectional
+        self.max_nodes = max_nodes
+        self.max_seconds = max_seconds
+        self.partial = partial
+        if connectivity not in (6, 18, 26):
+            raise ValueError(f"Unsupported connectivity: {connectivity}")
+        self.connectivity = connectivity
+        self.spacing = tuple(spacing) if spacing is not None else (1, 1, 1)
+        self.nodes_expanded = 0
+        self.status = None
         self.xy_extension = xy_extension
         self.z_extension = z_extension
         self.tracing_sensitivity = tracing_sensitivity
         self.is_multi = is_multi
 
-    def get_trace(self, start, end, arr):
+    def get_trace(self, start, end, arr, buffers=None, corridor=None, cancel=None, cost_cache=None):
+        """Trace from start to end through arr
+
+        The outcome of the search is left in `status`, one of SEARCH_STATUS.
+
+        Args:
+            cancel: optional CancelToken that stops the search when cancelled
+            buffers: SearchBuffers to use, the calling thread's if None
+            corridor: optional Corridor the path has to stay in. Only the
+                voxels of the corridor are read from arr and visited, instead
+                of the bounding box of start and end plus the extensions.
+            cost_cache: optional CostVolumeCache to take the cost of every
+                voxel from instead of computing it during the search. Not
+                used with a corridor, which reads only the voxels of the tube.
+        """
         t0 = time()
+        if buffers is None:
+            buffers = thread_search_buffers()
         start = list(map(int, start))
         end = list(map(int, end))
+        self.mask = None
 
-        minX0, minX1, minX2 = min(start[0], end[0]), min(start[1], end[1]), min(start[2], end[2])
-        self.maxX0, self.maxX1, self.maxX2 = max(start[0], end[0]), max(start[1], end[1]), max(start[2], end[2])
-        self.offsets = (max(minX0 - self.xy_extension, 0), max(minX1 - self.xy_extension, 0), max(minX2 - self.z_extension, 0))
+        if cost_cache is not None and corridor is None:
+            return self._get_trace_cached(start, end, arr, buffers, cancel, cost_cache)
 
-        self.W = arr[
-            self.offsets[0]: min(self.maxX0 + self.xy_extension, arr.shape[0]),
-            self.offsets[1]: min(self.maxX1 + self.xy_extension, arr.shape[1]),
-            self.offsets[2]: min(self.maxX2 + self.z_extension, arr.shape[2]),
-        ].astype(np.double)
+        if corridor is not None:
+            corridor = corridor.through(start, end)
+            lo, hi = corridor.bounds(arr.shape)
+            shape = [h - l for l, h in zip(lo, hi)]
+            self.offsets = tuple(lo)
+            self.W = corridor.read(arr, lo, shape)
+            self.mask = corridor.mask(lo, shape).view(np.uint8)
+        else:
+            lo, hi = self._box([start, end], arr.shape)
+            self.offsets = lo
+            self.W = arr[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+        if self.W.dtype != np.uint16 and self.W.dtype != np.float32:
+            self.W = self.W.astype(np.float32)
         t1 = time()
         # self.W = uniform_filter(self.W)
         self.base_intensity = (
-            self.W[start[0] - self.offsets[0], start[1] - self.offsets[1], start[2] - self.offsets[2]]
+            self.W[start[0] - self.offsets[0], start[1] - self.offsets[1], start[2] - self.offsets[2]].astype(np.double)
             + self.W[end[0] - self.offsets[0], end[1] - self.offsets[1], end[2] - self.offsets[2]]
         ) // 2
 
@@ -72,83 +227,216 @@ class AstarWrapper():
         p2.x1 = end[1] - self.offsets[1]
         p2.x2 = end[2] - self.offsets[2]
 
-        cdef int dims[3]
-        dims[:] = [self.W.shape[0], self.W.shape[1], self.W.shape[2]]
-
-        cdef float*** W
-        cdef float**** W_multi
+        limits = (self.max_nodes, self.max_seconds, cancel, self.partial)
+        neighbourhood = (self.connectivity, self.spacing)
         if self.is_multi:
-            W_multi = get_c_arr_multi(self.W)
+            path, self.nodes_expanded, status = _find_path_multi(self.W, p1, p2, self.is_soma, self.base_intensity, buffers, self.bidirectional, self.mask, limits, neighbourhood)
         else:
-            W = get_c_arr(self.W)
+            path, self.nodes_expanded, status = _find_path_single(self.W, p1, p2, self.is_soma, self.base_intensity, buffers, self.bidirectional, self.mask, limits, neighbourhood)
+        self.status = SEARCH_STATUS[status]
 
-        cdef float base_intensity[3]
-        cdef float base_intensity_i
-        cdef Astar* astar
-        cdef AstarMulti* astar_multi
-        cdef AstarResult res
+        points = [(int(p[0]+self.offsets[0]), int(p[1]+self.offsets[1]), int(p[2]+self.offsets[2])) for p in path]
 
-        if self.is_multi:
-            base_intensity[:] = [self.base_intensity[0], self.base_intensity[1], self.base_intensity[2]]
-            astar_multi = new AstarMulti(W_multi, dims, base_intensity)
-            t2 = time()
-            res = astar_multi.find_path_3d(p1, p2, self.is_soma)
-            t3 = time()
+        return points
+
+    def get_traces(self, start, ends, arr, buffers=None, cancel=None, cost_cache=None, distances=False):
+        """Trace from start to every point of ends with a single search
+
+        Runs Dijkstra from start over the bounding box of all the points plus
+        the extensions until every end is reached, instead of one search per
+        end. Per end, the outcome is left in `statuses` and the cost of its
+        path in `costs` (inf if not reached); `status` is that of the search.
+
+        Args:
+            ends: end points, may be empty with `distances`
+            distances: also leave the cost from start of every voxel of the box
+                in `distance_field` (inf where not reached), its origin in
+                `offsets`. Without ends the search covers the whole box.
+            cancel, buffers, cost_cache: as for `get_trace`
+
+        Returns:
+            one path per end, leaving out the endpoints as `get_trace` does.
+            Empty for ends that were not reached and for ends equal to start
+        """
+        if buffers is None:
+            buffers = thread_search_buffers()
+        start = list(map(int, start))
+        ends = [list(map(int, end)) for end in ends]
+        lo, hi = self._box([start, *ends], arr.shape)
+        self.offsets = lo
+
+        if cost_cache is None:
+            self.W = arr[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+            if self.W.dtype != np.uint16 and self.W.dtype != np.float32:
+                self.W = self.W.astype(np.float32)
+            voxels = [self.W[p[0] - lo[0], p[1] - lo[1], p[2] - lo[2]].astype(np.double) for p in [start, *ends]]
         else:
-            base_intensity_i = self.base_intensity
-            astar = new Astar(W, dims, base_intensity_i)
-            t2 = time()
-            res = astar.find_path_3d(p1, p2, self.is_soma)
-            t3 = time()
+            voxels = [np.asarray(arr[p[0]:p[0] + 1, p[1]:p[1] + 1, p[2]:p[2] + 1])[0, 0, 0].astype(np.double) for p in [start, *ends]]
+        self.base_intensity = (voxels[0] + np.mean(voxels[1:], axis=0)) // 2 if ends else voxels[0]
 
-        
-        points = [(int(res.path[i].x0+self.offsets[0]), int(res.path[i].x1+self.offsets[1]), int(res.path[i].x2+self.offsets[2])) for i in range(res.path_length)]
+        cdef Point p1
+        p1.x0, p1.x1, p1.x2 = start[0] - lo[0], start[1] - lo[1], start[2] - lo[2]
+        targets = [(p[0] - lo[0], p[1] - lo[1], p[2] - lo[2]) for p in ends]
 
-        # Cleanup
-        if self.is_multi:
-            for i in range(dims[0]):
-                for j in range(dims[1]):
-                    for k in range(dims[2]):
-                        free(W_multi[i][j][k])
-                    free(W_multi[i][j])
-                free(W_multi[i])
-            free(W_multi)
+        limits = (self.max_nodes, self.max_seconds, cancel, self.partial)
+        neighbourhood = (self.connectivity, self.spacing)
+        if cost_cache is not None:
+            costs, lowest = cost_cache.window(arr, lo, hi, self.base_intensity, self.tracing_sensitivity, self.is_multi)
+            results, self.nodes_expanded, status = _find_path_cost(costs, p1, p1, self.is_soma, lowest, buffers, False, None, limits, neighbourhood, targets)
+        elif self.is_multi:
+            results, self.nodes_expanded, status = _find_path_multi(self.W, p1, p1, self.is_soma, self.base_intensity, buffers, False, None, limits, neighbourhood, targets)
         else:
-            for i in range(dims[0]):
-                for j in range(dims[1]):
-                    free(W[i][j])
-                free(W[i])
-            free(W)
-        
-        free(res.path)
+            results, self.nodes_expanded, status = _find_path_single(self.W, p1, p1, self.is_soma, self.base_intensity, buffers, False, None, limits, neighbourhood, targets)
+        self.status = SEARCH_STATUS[status]
+        self.statuses = [SEARCH_STATUS[s] for _, _, s in results]
+        self.costs = [cost for _, cost, _ in results]
+        if distances:
+            self.distance_field = buffers.distances([h - l for l, h in zip(lo, hi)])
+
+        return [
+            [] if end == start else [(int(p[0] + lo[0]), int(p[1] + lo[1]), int(p[2] + lo[2])) for p in path]
+            for end, (path, _, _) in zip(ends, results)
+        ]
+
+    def _box(self, points, shape):
+        """Bounding box (lo, hi) of points plus the extensions, clipped to shape"""
+        extension = (self.xy_extension, self.xy_extension, self.z_extension)
+        lo = tuple(max(min(p[i] for p in points) - extension[i], 0) for i in range(3))
+        hi = tuple(min(max(p[i] for p in points) + extension[i], shape[i]) for i in range(3))
+        return lo, hi
+
+    def _get_trace_cached(self, start, end, arr, buffers, cancel, cost_cache):
+        lo, hi = self._box([start, end], arr.shape)
+        self.offsets = lo
+
+        voxels = [np.asarray(arr[p[0]:p[0] + 1, p[1]:p[1] + 1, p[2]:p[2] + 1])[0, 0, 0] for p in (start, end)]
+        self.base_intensity = (voxels[0].astype(np.double) + voxels[1]) // 2
+        costs, lowest = cost_cache.window(arr, lo, hi, self.base_intensity, self.tracing_sensitivity, self.is_multi)
+
+        cdef Point p1
+        p1.x0, p1.x1, p1.x2 = start[0] - lo[0], start[1] - lo[1], start[2] - lo[2]
+        cdef Point p2
+        p2.x0, p2.x1, p2.x2 = end[0] - lo[0], end[1] - lo[1], end[2] - lo[2]
+
+        limits = (self.max_nodes, self.max_seconds, cancel, self.partial)
+        neighbourhood = (self.connectivity, self.spacing)
+        path, self.nodes_expanded, status = _find_path_cost(costs, p1, p2, self.is_soma, lowest, buffers, self.bidirectional, None, limits, neighbourhood)
+        self.status = SEARCH_STATUS[status]
+
+        return [(int(p[0] + lo[0]), int(p[1] + lo[1]), int(p[2] + lo[2])) for p in path]
+
+
+ctypedef fused engine_t:
+    Astar[unsigned short]
+    Astar[float]
+    AstarMulti[unsigned short]
+    AstarMulti[float]
+    AstarCost
+
+
+cdef void _configure(engine_t* astar, const uint8_t[:, :, :] mask, tuple limits, tuple neighbourhood):
+    cdef long strides[3]
+    cdef float spacing[3]
+    if neighbourhood is not None:
+        connectivity, voxel_size = neighbourhood
+        for i in range(3):
+            spacing[i] = voxel_size[i]
+        astar.set_connectivity(connectivity, spacing)
+
+    if mask is not None:
+        for i in range(3):
+            strides[i] = mask.strides[i]
+        astar.set_mask(&mask[0, 0, 0], strides)
+
+    if limits is None:
+        return
+    max_nodes, max_seconds, cancel, partial = limits
+    cdef SearchLimits search_limits
+    search_limits.max_nodes = max_nodes or 0
+    search_limits.max_seconds = max_seconds or 0
+    search_limits.cancel = &(<CancelToken?>cancel).flag if cancel is not None else NULL
+    search_limits.partial = partial
+    astar.set_limits(search_limits)
+
+
+cdef list _collect_path(AstarResult& res):
+    return [(res.path[i].x0, res.path[i].x1, res.path[i].x2) for i in range(res.path_length)]
+
+
+cdef tuple _search(engine_t* astar, Point p1, Point p2, bool is_soma, SearchBuffers buffers, bint bidirectional, list targets):
+    """Run a configured engine from p1 to p2, or to every point of `targets` when given
+
+    Returns:
+        (path, nodes_expanded, status), with targets ([(path, cost, status)], nodes_expanded, status)
+    """
+    cdef AstarResult res
+    cdef vector[AstarResult] paths
+    cdef vector[Point] points
+    cdef Point p
+    if targets is not None:
+        for target in targets:
+            p.x0, p.x1, p.x2 = target
+            points.push_back(p)
+        with nogil:
+            res = astar.find_paths_3d(p1, points, is_soma, buffers.state[0], paths)
+        return [(_collect_path(paths[i]), paths[i].cost, paths[i].status) for i in range(paths.size())], res.nodes_expanded, res.status
+
+    with nogil:
+        if bidirectional:
+            res = astar.find_path_3d_bidirectional(p1, p2, is_soma, buffers.state[0], buffers.backward[0])
+        else:
+            res = astar.find_path_3d(p1, p2, is_soma, buffers.state[0])
+    return _collect_path(res), res.nodes_expanded, res.status
+
+
+def _find_path_single(const voxel_t[:, :, :] W, Point p1, Point p2, bool is_soma, base_intensity, SearchBuffers buffers, bint bidirectional=False, const uint8_t[:, :, :] mask=None, tuple limits=None, tuple neighbourhood=None, list targets=None):
+    """Run the single channel engine directly on the strided buffer of W"""
+    cdef int dims[3]
+    cdef long strides[4]
+    for i in range(3):
+        dims[i] = W.shape[i]
+        strides[i] = W.strides[i] // sizeof(voxel_t)
+    strides[3] = 0
+
+    cdef Astar[voxel_t]* astar = new Astar[voxel_t](&W[0, 0, 0], strides, dims, base_intensity)
+    _configure(astar, mask, limits, neighbourhood)
+    try:
+        return _search(astar, p1, p2, is_soma, buffers, bidirectional, targets)
+    finally:
+        del astar
+
+
+def _find_path_multi(const voxel_t[:, :, :, :] W, Point p1, Point p2, bool is_soma, base_intensity, SearchBuffers buffers, bint bidirectional=False, const uint8_t[:, :, :] mask=None, tuple limits=None, tuple neighbourhood=None, list targets=None):
+    """Run the multichannel engine directly on the strided buffer of W"""
+    cdef int dims[3]
+    cdef long strides[4]
+    for i in range(3):
+        dims[i] = W.shape[i]
+    for i in range(4):
+        strides[i] = W.strides[i] // sizeof(voxel_t)
+
+    cdef float base[3]
+    base[:] = [base_intensity[0], base_intensity[1], base_intensity[2]]
+    cdef AstarMulti[voxel_t]* astar = new AstarMulti[voxel_t](&W[0, 0, 0, 0], strides, dims, base)
+    _configure(astar, mask, limits, neighbourhood)
+    try:
+        return _search(astar, p1, p2, is_soma, buffers, bidirectional, targets)
+    finally:
+        del astar
 
-        return points
 
+def _find_path_cost(const float[:, :, :] C, Point p1, Point p2, bool is_soma, float lowest, SearchBuffers buffers, bint bidirectional=False, const uint8_t[:, :, :] mask=None, tuple limits=None, tuple neighbourhood=None, list targets=None):
+    """Run the engine on a precomputed cost volume, `lowest` its smallest cost"""
+    cdef int dims[3]
+    cdef long strides[4]
+    for i in range(3):
+        dims[i] = C.shape[i]
+        strides[i] = C.strides[i] // sizeof(float)
+    strides[3] = 0
 
-cdef float*** get_c_arr(double[:,:,:] arr):
-    t1 = time()
-    cdef float*** W = <float ***> malloc(arr.shape[0] * sizeof(float**))
-    cdef int i, j, k
-    for i in range(arr.shape[0]):
-        W[i] = <float**> malloc(arr.shape[1] * sizeof(float*))
-        for j in range(arr.shape[1]):
-            W[i][j] = <float*> malloc(arr.shape[2] * sizeof(float))
-            for k in range(arr.shape[2]):
-                W[i][j][k] = arr[i][j][k]
-    t2 = time()
-    return W
-
-cdef float**** get_c_arr_multi(double[:,:,:,:] arr):
-    t1 = time()
-    cdef float**** W = <float ****> malloc(arr.shape[0] * sizeof(float***))
-    cdef int i, j, k, c
-    for i in range(arr.shape[0]):
-        W[i] = <float***> malloc(arr.shape[1] * sizeof(float**))
-        for j in range(arr.shape[1]):
-            W[i][j] = <float**> malloc(arr.shape[2] * sizeof(float*))
-            for k in range(arr.shape[2]):
-                W[i][j][k] = <float*> malloc(arr.shape[3] * sizeof(float))
-                for c in range(arr.shape[3]):
-                    W[i][j][k][c] = arr[i][j][k][c]
-    t2 = time()
-    return W
+    cdef AstarCost* astar = new AstarCost(&C[0, 0, 0], strides, dims, lowest)
+    _configure(astar, mask, limits, neighbourhood)
+    try:
+        return _search(astar, p1, p2, is_soma, buffers, bidirectional, targets)
+    finally:
+        del astar
@@ -0,0 +1,28 @@
+#ifndef _H_astar_cost
+#define _H_astar_cost
+
+#include "search.h"
+
+// Searches a precomputed cost volume, the cost of entering every voxel of the box
+class AstarCost : public SearchSettings {
+    protected:
+    Volume<float> cost;
+    float lowest;
+
+    public:
+    float get_cost(const Point &u) const { return cost.at(u); }
+    float min_cost() const { return lowest; }
+
+    AstarCost(const float *cost, long strides[4], int d[3], float lowest): SearchSettings(d), cost(cost, strides), lowest(lowest) {}
+    AstarResult find_path_3d(Point& start, Point& end, bool is_soma, SearchState &state) {
+        return astar_search(*this, state, start, end, is_soma);
+    }
+    AstarResult find_path_3d_bidirectional(Point& start, Point& end, bool is_soma, SearchState &forward, SearchState &backward) {
+        return bidirectional_search(*this, forward, backward, start, end, is_soma);
+    }
+    AstarResult find_paths_3d(Point& start, std::vector<Point>& targets, bool is_soma, SearchState &state, std::vector<AstarResult> &paths) {
+        return dijkstra_search(*this, state, start, targets, is_soma, paths);
+    }
+};
+
+#endif
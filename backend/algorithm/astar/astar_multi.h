@@ -4,25 +4,27 @@
 #include <vector>
 #include "astar.h"
 
-class AstarMulti {
+template <typename T>
+class AstarMulti : public SearchSettings {
     protected:
-    float ****intensity;
-    int *dims;
-    float* base_intensity;
+    Volume<T> intensity;
+    float base_intensity[3];
     float base_intensity_sum;
 
-    void get_neighbors(Point &pos, int num_moves, Point* neighbors);
-    bool in_bounds(Point &pos);
-    float get_heuristic(Point &u, Point &v);
-    bool is_goal(Point &pos, Point &goal);
-    float get_cost(Point &u);
-    std::vector<Point> smoothen_path(std::vector<Point> &path);
-
     public:
-    AstarMulti(float ****intensity, int dims[3], float* base_intensity): intensity(intensity), dims(dims), base_intensity(base_intensity) {
+    float get_cost(const Point &u) const;
+    float min_cost() const;
+
+    AstarMulti(const T *intensity, long strides[4], int d[3], float* base): SearchSettings(d), intensity(intensity, strides) {
+        for (int i = 0; i < 3; ++i) {
+            base_intensity[i] = base[i];
+        }
         base_intensity_sum = base_intensity[0] + base_intensity[1] + base_intensity[2];
     }
     AstarResult find_path_3d(Point& start, Point& end, bool is_soma);
+    AstarResult find_path_3d(Point& start, Point& end, bool is_soma, SearchState &state);
+    AstarResult find_path_3d_bidirectional(Point& start, Point& end, bool is_soma, SearchState &forward, SearchState &backward);
+    AstarResult find_paths_3d(Point& start, std::vector<Point>& targets, bool is_soma, SearchState &state, std::vector<AstarResult> &paths);
 };
 
-#endif
\ No newline at end of file
+#endif
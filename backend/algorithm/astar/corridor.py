@@ -0,0 +1,100 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class Corridor:
+    """Tube around a polyline that a trace is allowed to pass through
+
+    The polyline can be a coarse path, a freehand stroke
+    (`FreehandState.traversed_points_pixel`) or the points of an existing
+    branch, in full resolution voxel coordinates. `radius` is the tube's
+    half-width in xy and z voxels, so anisotropic data keeps a round
+    cross-section in physical space.
+    """
+
+    points: list[tuple[int, int, int]]
+    radius: tuple[int, int] = (4, 2)
+
+    def through(self, start, end) -> "Corridor":
+        """Same corridor, extended to begin at `start` and finish at `end`"""
+        points = [tuple(map(int, p)) for p in self.points]
+        if len(points) > 1 and _distance(start, points[-1]) < _distance(start, points[0]):
+            points.reverse()
+        start, end = tuple(map(int, start)), tuple(map(int, end))
+        if len(points) == 0 or points[0] != start:
+            points.insert(0, start)
+        if points[-1] != end:
+            points.append(end)
+        return Corridor(points, self.radius)
+
+    def _segments(self):
+        if len(self.points) == 1:
+            return [(self.points[0], self.points[0])]
+        return list(zip(self.points[:-1], self.points[1:]))
+
+    def boxes(self, shape) -> list[tuple[list[int], list[int]]]:
+        """Voxel bounding box (lo, hi) of every segment of the tube, clipped to `shape`"""
+        r = (self.radius[0], self.radius[0], self.radius[1])
+        return [
+            (
+                [max(0, min(a[i], b[i]) - r[i]) for i in range(3)],
+                [min(shape[i], max(a[i], b[i]) + r[i] + 1) for i in range(3)],
+            )
+            for a, b in self._segments()
+        ]
+
+    def bounds(self, shape) -> tuple[list[int], list[int]]:
+        """Voxel bounding box (lo, hi) of the whole tube"""
+        boxes = self.boxes(shape)
+        return (
+            [min(lo[i] for lo, _ in boxes) for i in range(3)],
+            [max(hi[i] for _, hi in boxes) for i in range(3)],
+        )
+
+    def mask(self, offset, shape) -> np.ndarray:
+        """Boolean mask, `shape` voxels starting at `offset`, of the voxels inside the tube"""
+        mask = np.zeros(shape, dtype=bool)
+        z_scale = self.radius[0] / max(self.radius[1], 1e-6)
+        scale = np.array([1.0, 1.0, z_scale])
+        full_shape = [o + s for o, s in zip(offset, shape)]
+
+        for (a, b), (lo, hi) in zip(self._segments(), self.boxes(full_shape)):
+            lo = [max(l, o) for l, o in zip(lo, offset)]
+            if any(h <= l for l, h in zip(lo, hi)):
+                continue
+            grid = np.stack(
+                np.meshgrid(*[np.arange(l, h) for l, h in zip(lo, hi)], indexing="ij"), axis=-1
+            ) * scale
+            a_s, d = np.array(a) * scale, (np.array(b) - np.array(a)) * scale
+            length = d @ d
+            t = np.clip(((grid - a_s) @ d) / length, 0, 1) if length > 0 else 0
+            closest = a_s + np.multiply.outer(t, d)
+            inside = ((grid - closest) ** 2).sum(axis=-1) <= self.radius[0] ** 2
+
+            window = tuple(slice(l - o, h - o) for l, h, o in zip(lo, hi, offset))
+            mask[window] |= inside
+        return mask
+
+    def read(self, arr, offset, shape) -> np.ndarray:
+        """Read only the boxes of the tube from `arr` into a `shape` window at `offset`
+
+        Voxels outside every box are left at zero, so with a CdnArray only the
+        chunks the tube passes through are downloaded.
+        """
+        full_shape = [o + s for o, s in zip(offset, shape)]
+        out = None
+        for lo, hi in self.boxes(full_shape):
+            lo = [max(l, o) for l, o in zip(lo, offset)]
+            if any(h <= l for l, h in zip(lo, hi)):
+                continue
+            block = np.asarray(arr[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]])
+            if out is None:
+                out = np.zeros(tuple(shape) + block.shape[3:], dtype=block.dtype)
+            out[tuple(slice(l - o, h - o) for l, h, o in zip(lo, hi, offset))] = block
+        return out
+
+
+def _distance(a, b) -> float:
+    return sum((x - y) ** 2 for x, y in zip(a, b)) ** 0.5
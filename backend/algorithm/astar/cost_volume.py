@@ -0,0 +1,121 @@
+import itertools
+import math
+import threading
+import weakref
+
+import numpy as np
+
+from cdn.chunk_cache import ChunkCache
+
+DEFAULT_COST_CACHE_BYTES = 256 * 1024 * 1024  # 256 MiB
+COST_BLOCK_SIZE = 64
+"""Edge of the cubic blocks the cost volume is computed and cached in, in voxels"""
+BASE_BUCKET_RATIO = 1.05
+"""Base intensities within 5% of each other share a cost volume"""
+
+
+def base_bucket(base) -> int | tuple | None:
+    """Quantise a base intensity (a scalar, or one value per channel) on a log scale"""
+    if np.ndim(base) > 0:
+        return tuple(base_bucket(b) for b in base)
+    return round(math.log(base) / math.log(BASE_BUCKET_RATIO)) if base > 0 else None
+
+
+def bucket_base(bucket) -> float | list[float]:
+    """Representative base intensity of a bucket from `base_bucket`"""
+    if isinstance(bucket, tuple):
+        return [bucket_base(b) for b in bucket]
+    return BASE_BUCKET_RATIO**bucket if bucket is not None else 0.0
+
+
+def cost_volume(block: np.ndarray, base, is_multi: bool) -> np.ndarray:
+    """Cost of entering every voxel of `block`, as computed by the native engines
+
+    Single channel blocks are [x, y, z], multichannel blocks [x, y, z, channel].
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if not is_multi:
+            return np.power(np.float32(base) / block.astype(np.float32), np.float32(1.5))
+
+        block = block[..., :3].astype(np.float32)  # the native engine reads the first three channels
+        base = np.asarray(base, dtype=np.float32)[:3]
+        inst = block.sum(axis=3)
+        color_dist = (((base - block) / inst[..., None]) ** 2 + np.float32(0.0001)).sum(axis=3)
+        return color_dist + (base.sum() / inst) * np.float32(0.1)
+
+
+class CostVolumeCache:
+    """LRU cache of A* cost volumes, computed per aligned block of an image
+
+    Consecutive traces that extend the same branch search overlapping boxes,
+    so they only compute (and read from the image) the blocks the previous
+    traces have not. Blocks are keyed by image, block index, tracing
+    sensitivity and base intensity bucket; the base intensity of a trace is
+    rounded to its bucket, see `base_bucket`.
+
+    The single channel cost (base / I) ** 1.5 only scales with the base
+    intensity, which leaves the cheapest path unchanged, so single channel
+    blocks are computed for a base of 1 and shared by every base intensity.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_COST_CACHE_BYTES, block_size: int = COST_BLOCK_SIZE):
+        self.block_size = block_size
+        self._blocks = ChunkCache(max_bytes)
+        self._sources: dict[int, int] = {}
+        self._source_ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        return self._blocks.stats
+
+    def get_stats(self) -> dict:
+        return self._blocks.get_stats()
+
+    def clear(self):
+        self._blocks.clear()
+
+    def _source(self, arr) -> int:
+        """Stable id of an image for as long as it is alive"""
+        key = id(arr)
+        with self._lock:
+            if key not in self._sources:
+                self._sources[key] = next(self._source_ids)
+                try:
+                    weakref.finalize(arr, self._sources.pop, key, None)
+                except TypeError:
+                    pass  # not weak referenceable, the id stays taken
+            return self._sources[key]
+
+    def window(self, arr, lo, hi, base, tracing_sensitivity, is_multi: bool) -> tuple[np.ndarray, float]:
+        """Cost volume of `arr[lo:hi]`
+
+        Returns:
+            costs as a float32 [x, y, z] array, and the lowest cost in it
+        """
+        bucket = base_bucket(base[:3]) if is_multi else 0
+        source = self._source(arr)
+        size = self.block_size
+        shape = [h - l for l, h in zip(lo, hi)]
+        out = np.empty(shape, dtype=np.float32)
+
+        first = [l // size for l in lo]
+        last = [(h - 1) // size for h in hi]
+        for index in itertools.product(*[range(f, l + 1) for f, l in zip(first, last)]):
+            key = (source, index, tracing_sensitivity, bucket, is_multi)
+            block = self._blocks.get(key)
+            block_lo = [i * size for i in index]
+            if block is None:
+                block_hi = [min(b + size, s) for b, s in zip(block_lo, arr.shape)]
+                image = np.asarray(arr[block_lo[0]:block_hi[0], block_lo[1]:block_hi[1], block_lo[2]:block_hi[2]])
+                block = cost_volume(image, bucket_base(bucket), is_multi)
+                self._blocks.put(key, block)
+
+            src_lo = [max(l, b) for l, b in zip(lo, block_lo)]
+            src_hi = [min(h, b + s) for h, b, s in zip(hi, block_lo, block.shape)]
+            out[tuple(slice(s - l, e - l) for s, e, l in zip(src_lo, src_hi, lo))] = block[
+                tuple(slice(s - b, e - b) for s, e, b in zip(src_lo, src_hi, block_lo))
+            ]
+
+        finite = out[np.isfinite(out)]
+        return out, float(finite.min()) if finite.size else 0.0
@@ -0,0 +1,661 @@
+#ifndef _H_search
+#define _H_search
+
+#include <algorithm>
+#include <atomic>
+#include <chrono>
+#include <cmath>
+#include <cstdint>
+#include <cstdlib>
+#include <limits>
+#include <queue>
+#include <unordered_map>
+#include <unordered_set>
+#include <vector>
+
+struct Point {
+    int x0;
+    int x1;
+    int x2;
+    Point() {}
+    Point(int x0, int x1, int x2): x0(x0), x1(x1), x2(x2) {}
+};
+
+enum SearchStatus {
+    FOUND = 0,
+    NOT_FOUND = 1,
+    NODE_LIMIT = 2,
+    TIME_LIMIT = 3,
+    CANCELLED = 4,
+};
+
+struct AstarResult {
+    int path_length;
+    std::vector<Point> path;
+    long nodes_expanded;
+    int status;  // SearchStatus
+    float cost = std::numeric_limits<float>::infinity();  // of the path, set by one-to-many searches
+};
+
+struct Node {
+    Point point;
+    float cost;
+    float est_cost;
+};
+
+inline bool operator<(const Node t1, const Node t2) {
+    return t1.est_cost > t2.est_cost;
+}
+
+// Strided view of a voxel buffer owned by the caller (e.g. a numpy array), read in place
+template <typename T>
+struct Volume {
+    const T *data;
+    long strides[4];  // in elements, x0, x1, x2, channel
+
+    Volume(const T *data, long *s): data(data) {
+        for (int i = 0; i < 4; ++i) strides[i] = s[i];
+    }
+    inline float at(const Point &p) const {
+        return data[p.x0 * strides[0] + p.x1 * strides[1] + p.x2 * strides[2]];
+    }
+    inline float at(const Point &p, int c) const {
+        return data[p.x0 * strides[0] + p.x1 * strides[1] + p.x2 * strides[2] + c * strides[3]];
+    }
+};
+
+// Optional voxel mask, read in place like Volume. Voxels where it is zero are
+// never entered, which restricts a search to a corridor inside its box.
+struct SearchMask {
+    const uint8_t *data = nullptr;
+    long strides[3];
+
+    void set(const uint8_t *mask, long *s) {
+        data = mask;
+        for (int i = 0; i < 3; ++i) strides[i] = s[i];
+    }
+    inline bool allows(const Point &p) const {
+        return data == nullptr || data[p.x0 * strides[0] + p.x1 * strides[1] + p.x2 * strides[2]];
+    }
+};
+
+// Predecessor, g-cost and closed flag of every voxel touched by a search.
+//
+// Boxes up to DENSE_MAX_VOXELS are kept in flat arrays indexed by the voxel's
+// linear index (12 bytes per voxel), larger boxes fall back to a hash map that
+// only holds the voxels actually reached. The arrays are kept between searches
+// of the same box size; a generation stamp marks which entries belong to the
+// current search, so reset does not have to clear them.
+class SearchState {
+    public:
+    static const long DENSE_MAX_VOXELS = 1L << 26;
+
+    void reset(const int d[3]) {
+        dims[0] = d[0]; dims[1] = d[1]; dims[2] = d[2];
+        long n = (long) d[0] * d[1] * d[2];
+        dense = n <= DENSE_MAX_VOXELS;
+        sparse.clear();
+
+        if (!dense) {
+            release_dense();
+            return;
+        }
+        if ((long) stamp.size() != n) {
+            release_dense();
+            stamp.assign(n, 0);
+            prev.resize(n);
+            g.resize(n);
+            generation = 0;
+        }
+        if (generation >= UINT32_MAX - 2) {
+            std::fill(stamp.begin(), stamp.end(), 0);
+            generation = 0;
+        }
+        generation += 2;  // generation: seen, generation + 1: closed
+    }
+
+    void release() {
+        release_dense();
+        std::unordered_map<long, Entry>().swap(sparse);
+    }
+
+    inline long index(const Point &p) const {
+        return ((long) p.x0 * dims[1] + p.x1) * dims[2] + p.x2;
+    }
+    inline Point point(long i) const {
+        return Point(i / ((long) dims[1] * dims[2]), (i / dims[2]) % dims[1], i % dims[2]);
+    }
+
+    inline bool seen(long i) const {
+        if (dense) return stamp[i] >= generation;
+        return sparse.count(i) > 0;
+    }
+    inline bool closed(long i) const {
+        if (dense) return stamp[i] == generation + 1;
+        auto it = sparse.find(i);
+        return it != sparse.end() && it->second.closed;
+    }
+    inline float cost(long i) const {
+        if (dense) return g[i];
+        return sparse.find(i)->second.g;
+    }
+    inline long predecessor(long i) const {
+        if (dense) return prev[i];
+        return sparse.find(i)->second.prev;
+    }
+
+    inline void update(long i, float cost, long predecessor) {
+        if (dense) {
+            stamp[i] = generation;
+            g[i] = cost;
+            prev[i] = (int32_t) predecessor;
+        } else {
+            sparse[i] = {cost, predecessor, false};
+        }
+    }
+    inline void close(long i) {
+        if (dense) stamp[i] = generation + 1;
+        else sparse[i].closed = true;
+    }
+
+    // Cost from the start of every closed voxel, infinity elsewhere, into `out` in C order
+    void settled_costs(float *out) const {
+        long n = (long) dims[0] * dims[1] * dims[2];
+        if (dense) {
+            for (long i = 0; i < n; ++i) {
+                out[i] = stamp[i] == generation + 1 ? g[i] : std::numeric_limits<float>::infinity();
+            }
+            return;
+        }
+        std::fill(out, out + n, std::numeric_limits<float>::infinity());
+        for (auto &entry : sparse) {
+            if (entry.second.closed) out[entry.first] = entry.second.g;
+        }
+    }
+
+    size_t bytes() const {
+        return stamp.capacity() * sizeof(uint32_t) + prev.capacity() * sizeof(int32_t)
+            + g.capacity() * sizeof(float) + sparse.size() * (sizeof(long) + sizeof(Entry));
+    }
+
+    private:
+    struct Entry {
+        float g;
+        long prev;
+        bool closed;
+    };
+
+    int dims[3] = {0, 0, 0};
+    bool dense = true;
+    uint32_t generation = 0;
+    std::vector<uint32_t> stamp;
+    std::vector<int32_t> prev;
+    std::vector<float> g;
+    std::unordered_map<long, Entry> sparse;
+
+    void release_dense() {
+        std::vector<uint32_t>().swap(stamp);
+        std::vector<int32_t>().swap(prev);
+        std::vector<float>().swap(g);
+    }
+};
+
+// Set from any thread to stop the searches it was passed to
+struct CancelFlag {
+    std::atomic<bool> cancelled{false};
+
+    void cancel() { cancelled.store(true); }
+    void reset() { cancelled.store(false); }
+    bool is_cancelled() const { return cancelled.load(std::memory_order_relaxed); }
+};
+
+struct SearchLimits {
+    long max_nodes = 0;       // expanded nodes, 0 for no limit
+    double max_seconds = 0;   // wall time, 0 for no limit
+    const CancelFlag *cancel = nullptr;
+    bool partial = false;     // on a limit, return the path to the expanded node closest to the goal
+};
+
+// Counts the work of one search against its limits and remembers the expanded
+// node closest to the goal for partial results
+struct SearchProgress {
+    static const long CHECK_INTERVAL = 1024;  // expansions between clock/cancel checks
+
+    const SearchLimits &limits;
+    std::chrono::steady_clock::time_point started;
+    long nodes_expanded = 0;
+    long closest = -1;
+    long closest_distance = std::numeric_limits<long>::max();
+    bool smooth;
+
+    SearchProgress(const SearchLimits &limits, bool smooth): limits(limits), started(std::chrono::steady_clock::now()), smooth(smooth) {}
+
+    // Record an expansion, returns the status to stop with or FOUND to go on
+    SearchStatus expanded() {
+        ++nodes_expanded;
+        if (limits.max_nodes > 0 && nodes_expanded >= limits.max_nodes) {
+            return NODE_LIMIT;
+        }
+        if (nodes_expanded % CHECK_INTERVAL == 0) {
+            if (limits.cancel != nullptr && limits.cancel->is_cancelled()) {
+                return CANCELLED;
+            }
+            std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - started;
+            if (limits.max_seconds > 0 && elapsed.count() >= limits.max_seconds) {
+                return TIME_LIMIT;
+            }
+        }
+        return FOUND;
+    }
+
+    SearchStatus expanded(long i, const Point &p, const Point &goal) {
+        long dx = p.x0 - goal.x0, dy = p.x1 - goal.x1, dz = p.x2 - goal.x2;
+        long distance = dx * dx + dy * dy + dz * dz;
+        if (distance < closest_distance) {
+            closest_distance = distance;
+            closest = i;
+        }
+        return expanded();
+    }
+};
+
+// Neighbourhood of a search, the offset of every neighbour and the physical
+// length of the step to it. `spacing` is the voxel size relative to the finest
+// axis, so on isotropic data an axis step has length 1.
+struct Moves {
+    int count = 0;
+    int d[26][3];
+    float length[26];
+
+    // connectivity 6, 18 or 26. Soma traces stay in their z plane: 4 or, above 6, 8 neighbours
+    Moves(int connectivity, bool is_soma, const float spacing[3]) {
+        // axis steps first, in the order of the original 6-neighbourhood
+        static const int axis[6][3] = {{1, 0, 0}, {0, 1, 0}, {-1, 0, 0}, {0, -1, 0}, {0, 0, 1}, {0, 0, -1}};
+        for (int i = 0; i < 6; ++i) {
+            add(axis[i][0], axis[i][1], axis[i][2], is_soma, spacing);
+        }
+        if (connectivity <= 6) {
+            return;
+        }
+        for (int dx = -1; dx <= 1; ++dx) {
+            for (int dy = -1; dy <= 1; ++dy) {
+                for (int dz = -1; dz <= 1; ++dz) {
+                    int n = abs(dx) + abs(dy) + abs(dz);
+                    if (n >= 2 && (n == 2 || connectivity >= 26)) {
+                        add(dx, dy, dz, is_soma, spacing);
+                    }
+                }
+            }
+        }
+    }
+
+    inline Point neighbor(const Point &p, int i) const {
+        return Point(p.x0 + d[i][0], p.x1 + d[i][1], p.x2 + d[i][2]);
+    }
+
+    private:
+    void add(int dx, int dy, int dz, bool is_soma, const float spacing[3]) {
+        if (is_soma && dz != 0) {
+            return;
+        }
+        d[count][0] = dx; d[count][1] = dy; d[count][2] = dz;
+        length[count] = sqrt(pow(dx * spacing[0], 2) + pow(dy * spacing[1], 2) + pow(dz * spacing[2], 2));
+        ++count;
+    }
+};
+
+// Settings every engine exposes to the search functions below
+struct SearchSettings {
+    int dims[3];
+    SearchMask mask;
+    SearchLimits limits;
+    int connectivity = 6;
+    float spacing[3] = {1, 1, 1};
+
+    SearchSettings(int d[3]) {
+        dims[0] = d[0]; dims[1] = d[1]; dims[2] = d[2];
+    }
+    void set_mask(const uint8_t *m, long strides[3]) { mask.set(m, strides); }
+    void set_limits(SearchLimits &l) { limits = l; }
+    // 6, 18 or 26-connected moves, `s` the voxel size along each axis in any unit
+    void set_connectivity(int c, float s[3]) {
+        connectivity = c;
+        float finest = std::min(s[0], std::min(s[1], s[2]));
+        for (int i = 0; i < 3; ++i) spacing[i] = s[i] / finest;
+    }
+};
+
+// Physical distance between two voxels, in units of the finest axis
+inline float distance(const Point &u, const Point &v, const float spacing[3]) {
+    return sqrt(
+        pow((u.x0 - v.x0) * spacing[0], 2)
+        + pow((u.x1 - v.x1) * spacing[1], 2)
+        + pow((u.x2 - v.x2) * spacing[2], 2)
+    );
+}
+
+inline bool in_bounds(const Point& pos, const int dims[3]) {
+    return pos.x0 < dims[0] && pos.x0 >= 0 && pos.x1 < dims[1] && pos.x1 >= 0 && pos.x2 < dims[2] && pos.x2 >= 0;
+}
+
+inline bool is_goal(const Point &pos, const Point &goal) {
+    return (pos.x0 == goal.x0) && (pos.x1 == goal.x1) && (pos.x2 == goal.x2);
+}
+
+inline std::vector<Point> smoothen_path(std::vector<Point> &path) {
+    Point curr = path[0];
+    std::vector<Point> res;
+
+    int delta[3] = {0, 0, 0};
+
+    for (int i = 1; i < path.size(); ++i) {
+        Point& point = path[i];
+        Point& prev = path[i - 1];
+        int curr_delta[3] = { point.x0-prev.x0, point.x1-prev.x1, point.x2-prev.x2 };
+        bool added = false;
+        for (int j = 0; j < 3; ++j) {
+            if (abs(delta[j] + curr_delta[j]) == 2) {
+                res.push_back(Point(curr.x0 + delta[0], curr.x1 + delta[1], curr.x2 + delta[2]));
+                curr = res.back();
+                delta[0] = curr_delta[0];
+                delta[1] = curr_delta[1];
+                delta[2] = curr_delta[2];
+                added = true;
+                break;
+            }
+        }
+        if (!added) {
+            delta[0] += curr_delta[0];
+            delta[1] += curr_delta[1];
+            delta[2] += curr_delta[2];
+        }
+    }
+
+    res.push_back(Point(curr.x0 + delta[0], curr.x1 + delta[1], curr.x2 + delta[2]));
+    return res;
+}
+
+// Return a goal-to-start path (start excluded) start first. Paths restricted to
+// axis steps are smoothened, diagonal neighbourhoods are already smooth.
+inline AstarResult make_result(std::vector<Point> &res, const Point &last, const SearchProgress &progress, SearchStatus status) {
+    if (res.empty()) {
+        res.push_back(last);
+    }
+    std::vector<Point> f_res = progress.smooth ? smoothen_path(res) : res;
+    AstarResult result = {(int) f_res.size(), std::vector<Point>(f_res.rbegin(), f_res.rend()), progress.nodes_expanded, status};
+    return result;
+}
+
+inline AstarResult empty_result(const SearchProgress &progress, SearchStatus status) {
+    return {0, std::vector<Point>(), progress.nodes_expanded, status};
+}
+
+// Path from the start to voxel `last` of a search tree, or the partial result of a stopped search
+inline AstarResult trace_back(const SearchState &state, long last, const Point &start, const SearchProgress &progress, SearchStatus status) {
+    std::vector<Point> res;
+    for (long i = last; !is_goal(state.point(i), start); i = state.predecessor(i)) {
+        res.push_back(state.point(i));
+    }
+    return make_result(res, state.point(last), progress, status);
+}
+
+inline AstarResult stopped_result(const SearchState &state, const Point &start, const SearchProgress &progress, SearchStatus status) {
+    if (!progress.limits.partial || progress.closest == -1) {
+        return empty_result(progress, status);
+    }
+    return trace_back(state, progress.closest, start, progress, status);
+}
+
+// A* over the voxel grid shared by the single and multichannel engines.
+// The engine supplies `dims`, `mask`, `limits`, `connectivity`, `spacing`,
+// `get_cost(point)`, the cost of entering a voxel, and `min_cost()`, a lower
+// bound of it. A step costs the voxel's cost times the step's physical length,
+// so the straight-line distance to the goal times `min_cost()` never
+// overestimates the remaining cost and is consistent.
+template <class Engine>
+AstarResult astar_search(const Engine &engine, SearchState &state, Point &start, Point &end, bool is_soma) {
+    Moves moves(engine.connectivity, is_soma, engine.spacing);
+    float heuristic_scale = engine.min_cost();
+
+    state.reset(engine.dims);
+    std::priority_queue<Node> frontier;
+    long goal = state.index(end);
+    SearchProgress progress(engine.limits, engine.connectivity <= 6);
+
+    state.update(state.index(start), 0, -1);
+    Node n = {start, 0, heuristic_scale * distance(start, end, engine.spacing)};
+    frontier.push(n);
+
+    while (!frontier.empty()) {
+        auto curr = frontier.top();
+        frontier.pop();
+        long u = state.index(curr.point);
+        if (state.closed(u) || curr.cost > state.cost(u)) {
+            continue;  // stale entry, a cheaper route was queued later
+        }
+        state.close(u);
+        if (u == goal) {
+            ++progress.nodes_expanded;
+            return trace_back(state, goal, start, progress, FOUND);
+        }
+        SearchStatus status = progress.expanded(u, curr.point, end);
+        if (status != FOUND) {
+            return stopped_result(state, start, progress, status);
+        }
+
+        for (int i = 0; i < moves.count; ++i) {
+            Point new_pos = moves.neighbor(curr.point, i);
+            if (!in_bounds(new_pos, engine.dims) || !engine.mask.allows(new_pos)) {
+                continue;
+            }
+            long v = state.index(new_pos);
+            if (state.closed(v)) {
+                continue;
+            }
+            float c = engine.get_cost(new_pos) * moves.length[i] + curr.cost;
+            if (!state.seen(v) || c < state.cost(v)) {
+                state.update(v, c, u);
+                float est_c = c + heuristic_scale * distance(new_pos, end, engine.spacing);
+                Node new_n = {new_pos, c, est_c};
+                frontier.push(new_n);
+            }
+        }
+    }
+
+    return stopped_result(state, start, progress, NOT_FOUND);
+}
+
+// Dijkstra from `start` to several targets at once, one entry of `paths` per
+// target. The search stops once every target is closed, or covers the whole
+// box when `targets` is empty, leaving the cost of every voxel reached in
+// `state` (see SearchState::settled_costs). Targets not reached when it stops
+// get no path and the status it stopped with. Returns the work done and the
+// overall status, without a path.
+template <class Engine>
+AstarResult dijkstra_search(const Engine &engine, SearchState &state, Point &start, std::vector<Point> &targets, bool is_soma, std::vector<AstarResult> &paths) {
+    Moves moves(engine.connectivity, is_soma, engine.spacing);
+
+    state.reset(engine.dims);
+    std::priority_queue<Node> frontier;
+    SearchProgress progress(engine.limits, engine.connectivity <= 6);
+    std::unordered_set<long> remaining;
+    for (auto &target : targets) {
+        remaining.insert(state.index(target));
+    }
+
+    state.update(state.index(start), 0, -1);
+    frontier.push({start, 0, 0});
+    SearchStatus stopped = FOUND;
+
+    while (!frontier.empty() && (targets.empty() || !remaining.empty())) {
+        auto curr = frontier.top();
+        frontier.pop();
+        long u = state.index(curr.point);
+        if (state.closed(u) || curr.cost > state.cost(u)) {
+            continue;
+        }
+        state.close(u);
+        remaining.erase(u);
+        SearchStatus status = progress.expanded();
+        if (status != FOUND) {
+            stopped = status;
+            break;
+        }
+
+        for (int i = 0; i < moves.count; ++i) {
+            Point new_pos = moves.neighbor(curr.point, i);
+            if (!in_bounds(new_pos, engine.dims) || !engine.mask.allows(new_pos)) {
+                continue;
+            }
+            long v = state.index(new_pos);
+            if (state.closed(v)) {
+                continue;
+            }
+            float c = engine.get_cost(new_pos) * moves.length[i] + curr.cost;
+            if (!state.seen(v) || c < state.cost(v)) {
+                state.update(v, c, u);
+                frontier.push({new_pos, c, c});
+            }
+        }
+    }
+
+    if (stopped == FOUND && !remaining.empty()) {
+        stopped = NOT_FOUND;
+    }
+    paths.clear();
+    for (auto &target : targets) {
+        long t = state.index(target);
+        if (!state.closed(t)) {
+            paths.push_back(empty_result(progress, stopped));
+            continue;
+        }
+        paths.push_back(trace_back(state, t, start, progress, FOUND));
+        paths.back().cost = state.cost(t);
+    }
+    return empty_result(progress, stopped);
+}
+
+// Potential of a bidirectional search, half the difference of the distance
+// heuristics towards either endpoint. The forward side orders its nodes by
+// cost plus the potential and the backward side by cost minus it, so the two
+// sides stay consistent with each other and the keys of their open nodes can
+// be added up against the best connection.
+struct BidirectionalPotential {
+    Point start, end;
+    const float *spacing;
+    float scale;
+
+    float operator()(const Point &p) const {
+        return scale * (distance(p, end, spacing) - distance(p, start, spacing)) / 2;
+    }
+};
+
+// Expand one node of a bidirectional search. The forward side pays for the
+// voxel it enters and the backward side for the voxel it leaves, so both
+// accumulate the same cost for a given path. Updates `best` and `meet` when
+// the node connects to a voxel already reached by the other side.
+template <class Engine>
+SearchStatus expand_bidirectional(
+    const Engine &engine, std::priority_queue<Node> &frontier, SearchState &state, SearchState &other,
+    bool forward, const Moves &moves, const BidirectionalPotential &potential,
+    float &best, long &meet, SearchProgress &progress, const Point &end
+) {
+    auto curr = frontier.top();
+    frontier.pop();
+    long u = state.index(curr.point);
+    if (state.closed(u) || curr.cost > state.cost(u)) {
+        return FOUND;
+    }
+    state.close(u);
+    SearchStatus status = forward ? progress.expanded(u, curr.point, end) : progress.expanded();
+    if (status != FOUND) {
+        return status;
+    }
+
+    float leave_cost = forward ? 0 : engine.get_cost(curr.point);
+    for (int i = 0; i < moves.count; ++i) {
+        Point new_pos = moves.neighbor(curr.point, i);
+        if (!in_bounds(new_pos, engine.dims) || !engine.mask.allows(new_pos)) {
+            continue;
+        }
+        long v = state.index(new_pos);
+        if (state.closed(v)) {
+            continue;
+        }
+        float c = curr.cost + (forward ? engine.get_cost(new_pos) : leave_cost) * moves.length[i];
+        if (!state.seen(v) || c < state.cost(v)) {
+            state.update(v, c, u);
+            Node new_n = {new_pos, c, c + (forward ? potential(new_pos) : -potential(new_pos))};
+            frontier.push(new_n);
+        }
+        if (other.seen(v) && state.cost(v) + other.cost(v) < best) {
+            best = state.cost(v) + other.cost(v);
+            meet = v;
+        }
+    }
+    return FOUND;
+}
+
+// Searches from both endpoints at once and joins the two trees where they
+// meet, which explores roughly two balls of half the trace length instead of
+// one of the full length. Both sides are expanded in cost order, the search
+// stops once the cheapest open nodes of the two sides together cost at least
+// as much as the best connection found, so the path cost matches the
+// unidirectional search. Both sides are guided by the scaled distance
+// heuristic of the unidirectional search through a shared potential (see
+// BidirectionalPotential), which halves its strength. A partial result
+// follows the forward tree.
+template <class Engine>
+AstarResult bidirectional_search(
+    const Engine &engine, SearchState &forward, SearchState &backward, Point &start, Point &end, bool is_soma
+) {
+    Moves moves(engine.connectivity, is_soma, engine.spacing);
+    BidirectionalPotential potential = {start, end, engine.spacing, engine.min_cost()};
+
+    forward.reset(engine.dims);
+    backward.reset(engine.dims);
+    std::priority_queue<Node> forward_frontier, backward_frontier;
+    SearchProgress progress(engine.limits, engine.connectivity <= 6);
+
+    long s = forward.index(start), goal = forward.index(end);
+    forward.update(s, 0, -1);
+    backward.update(goal, 0, -1);
+    forward_frontier.push({start, 0, potential(start)});
+    backward_frontier.push({end, 0, -potential(end)});
+
+    float best = s == goal ? 0 : std::numeric_limits<float>::infinity();
+    long meet = s == goal ? s : -1;
+
+    while (!forward_frontier.empty() && !backward_frontier.empty()) {
+        if (forward_frontier.top().est_cost + backward_frontier.top().est_cost >= best) {
+            break;
+        }
+        SearchStatus status;
+        if (forward_frontier.size() <= backward_frontier.size()) {
+            status = expand_bidirectional(engine, forward_frontier, forward, backward, true, moves, potential, best, meet, progress, end);
+        } else {
+            status = expand_bidirectional(engine, backward_frontier, backward, forward, false, moves, potential, best, meet, progress, end);
+        }
+        if (status != FOUND) {
+            return stopped_result(forward, start, progress, status);
+        }
+    }
+
+    if (meet == -1) {
+        return stopped_result(forward, start, progress, NOT_FOUND);
+    }
+
+    // goal ... meet from the backward tree, then up to the start from the forward tree
+    std::vector<Point> res;
+    for (long i = meet; i != -1; i = backward.predecessor(i)) {
+        res.push_back(forward.point(i));
+    }
+    std::reverse(res.begin(), res.end());
+    res.pop_back();
+    for (long i = meet; i != s; i = forward.predecessor(i)) {
+        res.push_back(forward.point(i));
+    }
+    return make_result(res, end, progress, FOUND);
+}
+
+#endif
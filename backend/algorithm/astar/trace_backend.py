@@ -0,0 +1,137 @@
+import traceback
+from abc import ABC, abstractmethod
+
+from algorithm.astar.AstarWrapper import CancelToken
+from algorithm.astar.cost_volume import CostVolumeCache
+from algorithm.astar.tracing import TraceInterrupted, get_trace, get_trace_cdn
+
+LOGGER_TAG = "TRACE"
+TRACE_BACKENDS = ("local", "remote", "auto")
+"""`auto` traces locally and falls back to the remote service if that fails"""
+
+
+def with_endpoints(path, start, end) -> list:
+    """`path` with `start` and `end` added where it stops one voxel short of them
+
+    The engines leave both out of a path, a partial path that stops further
+    from the end is left without it.
+    """
+    path = [list(map(int, p)) for p in path]
+    start, end = list(map(int, start)), list(map(int, end))
+    if len(path) == 0:
+        return path if start != end else [start]
+    if path[0] != start:
+        path.insert(0, start)
+    if path[-1] != end and max(abs(a - b) for a, b in zip(path[-1], end)) <= 1:
+        path.append(end)
+    return path
+
+
+class TraceBackend(ABC):
+    """Runs traces between two full resolution points"""
+
+    name = "none"
+
+    @abstractmethod
+    def trace(self, start, end, is_soma: bool = False, tracing_sensitivity=5, cancel: CancelToken | None = None) -> list:
+        """Path from start to end, both included, in full resolution voxels
+
+        Raises:
+            TraceInterrupted: a limit was hit or the trace was cancelled
+        """
+
+
+class LocalTraceBackend(TraceBackend):
+    """Native A* in this process, reading the image through the cached CdnArray"""
+
+    name = "local"
+
+    def __init__(self, coords, is_multi: bool, max_nodes=0, max_seconds=0, partial=False, cost_cache: CostVolumeCache | None = None, coarse_to_fine=False):
+        self.coords = coords
+        self.is_multi = is_multi
+        self.max_nodes = max_nodes
+        self.max_seconds = max_seconds
+        self.partial = partial
+        self.cost_cache = cost_cache
+        self.coarse_to_fine = coarse_to_fine
+
+    def trace(self, start, end, is_soma=False, tracing_sensitivity=5, cancel=None):
+        path = get_trace(
+            self.coords,
+            start,
+            end,
+            self.is_multi,
+            is_soma,
+            tracing_sensitivity=tracing_sensitivity,
+            max_nodes=self.max_nodes,
+            max_seconds=self.max_seconds,
+            partial=self.partial,
+            cancel=cancel,
+            cost_cache=self.cost_cache,
+            coarse_to_fine=self.coarse_to_fine,
+        )
+        return with_endpoints(path, start, end)
+
+
+class RemoteTraceBackend(TraceBackend):
+    """The `{server}/{dataset}/tracing/{start}/{end}` endpoint of the CDN server"""
+
+    name = "remote"
+
+    def __init__(self, server_url: str, dataset_id: str, is_multi: bool, max_seconds=None):
+        self.server_url = server_url
+        self.dataset_id = dataset_id
+        self.is_multi = is_multi
+        self.max_seconds = max_seconds
+
+    def trace(self, start, end, is_soma=False, tracing_sensitivity=5, cancel=None):
+        path = get_trace_cdn(
+            self.server_url,
+            self.dataset_id,
+            start,
+            end,
+            self.is_multi,
+            is_soma,
+            tracing_sensitivity=tracing_sensitivity,
+            max_seconds=self.max_seconds,
+            cancel=cancel,
+        )
+        return with_endpoints(path, start, end)
+
+
+class FallbackTraceBackend(TraceBackend):
+    """Traces with `primary`, and with `fallback` when `primary` fails
+
+    A trace stopped by its limits or cancelled is not a failure, it is raised
+    as is instead of being run again. The first failure is logged with its
+    traceback, so a `primary` that always fails does not go unnoticed.
+    """
+
+    def __init__(self, primary: TraceBackend, fallback: TraceBackend):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = f"{primary.name}, falling back to {fallback.name}"
+        self.fallbacks = 0
+
+    def trace(self, start, end, is_soma=False, tracing_sensitivity=5, cancel=None):
+        try:
+            return self.primary.trace(start, end, is_soma, tracing_sensitivity, cancel)
+        except TraceInterrupted:
+            raise
+        except Exception as e:
+            self.fallbacks += 1
+            print(f"[{LOGGER_TAG}] {self.primary.name} trace failed ({self.fallbacks} so far), using {self.fallback.name}: {e!r}")
+            if self.fallbacks == 1:
+                traceback.print_exc()
+            return self.fallback.trace(start, end, is_soma, tracing_sensitivity, cancel)
+
+
+def make_trace_backend(mode: str, local: TraceBackend, remote: TraceBackend) -> TraceBackend:
+    """Backend for a TRACE_BACKEND setting, one of TRACE_BACKENDS"""
+    if mode == "local":
+        return local
+    if mode == "remote":
+        return remote
+    if mode == "auto":
+        return FallbackTraceBackend(local, remote)
+    raise ValueError(f"Unknown tracing backend: {mode}, expected one of {', '.join(TRACE_BACKENDS)}")
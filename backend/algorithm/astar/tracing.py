@@ -1,22 +1,73 @@
 from time import time
 
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from math import floor, ceil
 import multiprocessing
 import requests
 import posixpath
+import numpy as np
 # cimport numpy as np
-from algorithm.astar.AstarWrapper import AstarWrapper as Astar
+from algorithm.astar.AstarWrapper import AstarWrapper as Astar, CancelToken
+from algorithm.astar.corridor import Corridor
+from algorithm.astar.cost_volume import CostVolumeCache
+from cdn.point_encoding import ACCEPT_POINTS, decode_points
 
-def get_trace_cdn(server_url: str, dataset_id: str, start, end, is_multi, is_soma = False, xy_extension = 21, z_extension = 7, rScale = 10, seg_len = 25, tracing_sensitivity = 5):
+DEFAULT_TRACE_WORKERS = os.cpu_count() or 4
+"""Traces run concurrently by the default executor, the native search releases the GIL"""
+
+_trace_workers = DEFAULT_TRACE_WORKERS
+_default_executor: ThreadPoolExecutor | None = None
+_refine_executor: ThreadPoolExecutor | None = None
+_default_executor_lock = threading.Lock()
+
+
+class TraceInterrupted(Exception):
+    """A trace stopped by its limits or cancelled before it reached the end point"""
+
+    def __init__(self, status: str):
+        super().__init__(f"Trace stopped: {status.replace('_', ' ')}")
+        self.status = status
+
+
+def get_trace_cdn(server_url: str, dataset_id: str, start, end, is_multi, is_soma = False, xy_extension = 21, z_extension = 7, rScale = 10, seg_len = 25, tracing_sensitivity = 5, max_seconds = None, cancel: CancelToken | None = None):
     url = posixpath.join(server_url, dataset_id, "tracing", f"{start[0]},{start[1]},{start[2]}", f"{end[0]},{end[1]},{end[2]}")
-    res = requests.get(url, params={"is_soma": "true" if is_soma else "false"})
+    try:
+        res = requests.get(url, params={"is_soma": "true" if is_soma else "false"}, headers={"Accept": ACCEPT_POINTS}, timeout=max_seconds or None)
+    except requests.Timeout:
+        raise TraceInterrupted("time_limit")
+    if cancel is not None and cancel.cancelled:
+        raise TraceInterrupted("cancelled")
     if res.status_code == 200:
-        return [[int(p) for p in x.split(',')] for x in res.text.split('\n')[:-1]]
+        return decode_points(res.content, res.headers.get("Content-Type")).tolist()
     else:
         raise Exception(f"[{res.status_code}] {res.text}")
 
 
-def get_trace(coords, start, end, is_multi, is_soma = False, xy_extension = 21, z_extension = 7, rScale = 10, seg_len = 25, tracing_sensitivity = 5):
+def get_trace(coords, start, end, is_multi, is_soma = False, xy_extension = 21, z_extension = 7, rScale = 10, seg_len = 25, tracing_sensitivity = 5, bidirectional = False, coarse_to_fine = False, corridor: Corridor | None = None, max_nodes = 0, max_seconds = 0, partial = False, cancel: CancelToken | None = None, connectivity = 6, cost_cache: CostVolumeCache | None = None):
+    """Trace between two full resolution points with the native A*
+
+    Args:
+        connectivity: 6, 18 or 26-connected search. Above 6, steps are weighted
+            by the dataset's voxel size (`coords.scale`)
+        max_nodes: stop the search after expanding this many voxels, 0 for no limit
+        max_seconds: stop the search after this much wall time, 0 for no limit
+        partial: on a limit or cancel, return the path toward the end found so
+            far instead of raising TraceInterrupted
+        cancel: CancelToken that stops the search from another thread
+        cost_cache: CostVolumeCache shared by consecutive traces, so voxel costs
+            of a region already searched are not read and computed again
+
+    Raises:
+        TraceInterrupted: a limit was hit or the trace was cancelled, and `partial` is False
+    """
+    limits = dict(max_nodes=max_nodes, max_seconds=max_seconds, partial=partial)
+    neighbourhood = dict(connectivity=connectivity, spacing=getattr(coords, "scale", None) if connectivity > 6 else None)
+    if coarse_to_fine:
+        return get_trace_coarse_to_fine(coords, start, end, is_multi, is_soma, xy_extension, z_extension, rScale, seg_len, tracing_sensitivity, cancel=cancel, connectivity=connectivity, **limits)
+
     # manager = multiprocessing.Manager()
     # rtrn = manager.dict()
 
@@ -26,8 +77,10 @@ def get_trace(coords, start, end, is_multi, is_soma = False, xy_extension = 21,
     # p = multiprocessing.Process(target = traceThread, name = "Trace", args = (rtrn, "Trace", coords, start, end, is_soma, xy_extension, z_extension, res_index, seg_len, tracing_sensitivity, is_multi, False))
     # p.start()
     # p.join(15)
-    tracer = Astar(is_soma, xy_extension, z_extension, tracing_sensitivity, is_multi)
-    res = tracer.get_trace(start, end, coords.layer_data[0])
+    tracer = Astar(is_soma, xy_extension, z_extension, tracing_sensitivity, is_multi, bidirectional, **limits, **neighbourhood)
+    res = tracer.get_trace(start, end, coords.layer_data[0], corridor=corridor, cancel=cancel, cost_cache=cost_cache)
+    if tracer.status in ("node_limit", "time_limit", "cancelled") and not partial:
+        raise TraceInterrupted(tracer.status)
     return res
 
     # if len(multiprocessing.active_children()) > 1 or not("Trace" in rtrn):
@@ -44,62 +97,219 @@ def get_trace(coords, start, end, is_multi, is_soma = False, xy_extension = 21,
     # return astar_single_channel(coords.imPath, start, end, is_soma, xy_extension, z_extension)
 
 
-def traceThread(rtrn, name, coords, start, end, is_soma, xy_extension, z_extension, res, seg_len, tracing_sensitivity, is_multi, thread_ind = False):
-    return
-    if is_multi:
-        tracer = AstarMulti(start, end, coords, is_soma, xy_extension, z_extension, res, tracing_sensitivity=tracing_sensitivity)
+def get_traces(coords, start, ends, is_multi, is_soma = False, xy_extension = 21, z_extension = 7, tracing_sensitivity = 5, max_nodes = 0, max_seconds = 0, cancel: CancelToken | None = None, connectivity = 6, cost_cache: CostVolumeCache | None = None) -> list[tuple[list, float]]:
+    """Trace from one full resolution point to several with a single search
+
+    Cheaper than one `get_trace` per end when joining a branch to several
+    candidates, e.g. to pick the nearest existing neurite by path cost. No
+    request handler uses it yet, `join_branches` joins two given terminals
+    and traces through the trace backend.
+
+    Returns:
+        (path, cost) per end, an empty path and an infinite cost for ends not reached,
+        an empty path and a cost of 0 for an end at start
+
+    Raises:
+        TraceInterrupted: a limit was hit or the search was cancelled before every end was reached
+    """
+    neighbourhood = dict(connectivity=connectivity, spacing=getattr(coords, "scale", None) if connectivity > 6 else None)
+    tracer = Astar(is_soma, xy_extension, z_extension, tracing_sensitivity, is_multi, max_nodes=max_nodes, max_seconds=max_seconds, **neighbourhood)
+    paths = tracer.get_traces(start, ends, coords.layer_data[0], cancel=cancel, cost_cache=cost_cache)
+    if tracer.status in ("node_limit", "time_limit", "cancelled"):
+        raise TraceInterrupted(tracer.status)
+    return list(zip(paths, tracer.costs))
+
+
+def get_distance_field(coords, start, is_multi, is_soma = False, xy_extension = 21, z_extension = 7, tracing_sensitivity = 5, max_nodes = 0, max_seconds = 0, cancel: CancelToken | None = None, connectivity = 6, cost_cache: CostVolumeCache | None = None) -> tuple[tuple[int, int, int], np.ndarray]:
+    """Geodesic cost from a full resolution point to every voxel within the extensions around it
+
+    Library API like `get_traces`, not used by the request handlers.
+
+    Returns:
+        offset of the box, and its float32 costs (inf where not reached before a limit)
+    """
+    neighbourhood = dict(connectivity=connectivity, spacing=getattr(coords, "scale", None) if connectivity > 6 else None)
+    tracer = Astar(is_soma, xy_extension, z_extension, tracing_sensitivity, is_multi, max_nodes=max_nodes, max_seconds=max_seconds, **neighbourhood)
+    tracer.get_traces(start, [], coords.layer_data[0], cancel=cancel, cost_cache=cost_cache, distances=True)
+    return tracer.offsets, tracer.distance_field
+
+
+def set_trace_workers(workers: int):
+    """Size of the default executors, pools created with the old size finish their work and are replaced"""
+    global _trace_workers, _default_executor, _refine_executor
+    with _default_executor_lock:
+        _trace_workers = workers
+        for executor in (_default_executor, _refine_executor):
+            if executor is not None:
+                executor.shutdown(wait=False)
+        _default_executor = _refine_executor = None
+
+
+def default_trace_executor() -> ThreadPoolExecutor:
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = ThreadPoolExecutor(
+                max_workers=_trace_workers, thread_name_prefix="trace"
+            )
+        return _default_executor
+
+
+def default_refine_executor() -> ThreadPoolExecutor:
+    """Pool for the segments of coarse-to-fine traces
+
+    Separate from `default_trace_executor()` so a coarse-to-fine trace running
+    on a trace worker never waits on work queued behind itself.
+    """
+    global _refine_executor
+    with _default_executor_lock:
+        if _refine_executor is None:
+            _refine_executor = ThreadPoolExecutor(
+                max_workers=_trace_workers, thread_name_prefix="trace_refine"
+            )
+        return _refine_executor
+
+
+async def trace_async(coords, start, end, is_multi, executor: ThreadPoolExecutor | None = None, **kwargs):
+    """Run `get_trace` on a worker thread without blocking the event loop
+
+    The A* search itself runs without the GIL, so independent traces awaited
+    together (e.g. with `asyncio.gather`) run in parallel on separate cores.
+
+    Args:
+        executor: pool to run the trace on, `default_trace_executor()` if None
+        kwargs: forwarded to `get_trace`
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor or default_trace_executor(),
+        lambda: get_trace(coords, start, end, is_multi, **kwargs),
+    )
+
+
+def _level_factors(coords, level: int) -> list[float]:
+    """Full resolution voxels per voxel of pyramid level `level`, per axis"""
+    fine, coarse = coords.layer_data[0].shape, coords.layer_data[level].shape
+    return [fine[i] / coarse[i] for i in range(3)]
+
+
+def _snap_to_signal(image, point, radius) -> list[int]:
+    """Brightest voxel within `radius` of a point upsampled from a coarse path"""
+    lo = [max(0, p - r) for p, r in zip(point, radius)]
+    hi = [min(size, p + r + 1) for p, r, size in zip(point, radius, image.shape)]
+    block = np.asarray(image[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]], dtype=np.float32)
+    if block.ndim == 4:
+        block = block.sum(axis=3)
+    offset = np.unravel_index(np.argmax(block), block.shape)
+    return [l + int(o) for l, o in zip(lo, offset)]
+
+
+def get_trace_coarse_to_fine(coords, start, end, is_multi, is_soma = False, xy_extension = 21, z_extension = 7, rScale = 10, seg_len = 25, tracing_sensitivity = 5, level = None, executor = None, cancel: CancelToken | None = None, **limits):
+    """Trace on a downsampled pyramid level, then refine along that path
+
+    The coarse path is cut into waypoints roughly `seg_len` full resolution
+    voxels apart, each snapped to the brightest voxel of its coarse voxel. The
+    segments between waypoints are traced in parallel at full resolution, each
+    restricted to a corridor a couple of coarse voxels wide around the coarse
+    path, so a long trace reads and searches a tube instead of the full
+    bounding box.
+
+    Args:
+        level: pyramid level of the coarse pass, picked from the distance
+            between the points (`sqrt(distance) // rScale`) if None
+        executor: pool the segments are refined on, `default_refine_executor()` if None
+        cancel, limits: as for `get_trace`, applied to every search of the pipeline.
+            With `partial`, a segment that stops short ends the path at the
+            last waypoint reached
+
+    Returns:
+        list of full resolution points, like `get_trace`
+
+    Raises:
+        TraceInterrupted: a search hit a limit or was cancelled, and `partial` is False
+    """
+    dist = abs(start[0] - end[0]) + abs(start[1] - end[1]) + abs(start[2] - end[2])
+    if level is None:
+        level = min(int((dist ** 0.5) // rScale), len(coords.layer_data) - 1)
+    if level <= 0:
+        return get_trace(coords, start, end, is_multi, is_soma, xy_extension, z_extension, tracing_sensitivity=tracing_sensitivity, cancel=cancel, **limits)
+
+    image = coords.layer_data[0]
+    factors = _level_factors(coords, level)
+    coarse_shape = coords.layer_data[level].shape
+    coarse_start = [min(int(p // f), s - 1) for p, f, s in zip(start, factors, coarse_shape)]
+    coarse_end = [min(int(p // f), s - 1) for p, f, s in zip(end, factors, coarse_shape)]
+
+    coarse_tracer = Astar(
+        is_soma,
+        max(2, ceil(xy_extension / factors[0])),
+        max(1, ceil(z_extension / factors[2])),
+        tracing_sensitivity,
+        is_multi,
+        max_nodes=limits.get("max_nodes", 0),
+        max_seconds=limits.get("max_seconds", 0),
+    )
+    coarse_path = coarse_tracer.get_trace(coarse_start, coarse_end, coords.layer_data[level], cancel=cancel)
+    if coarse_tracer.status == "cancelled":
+        raise TraceInterrupted("cancelled")
+    if len(coarse_path) == 0:
+        return get_trace(coords, start, end, is_multi, is_soma, xy_extension, z_extension, tracing_sensitivity=tracing_sensitivity, cancel=cancel, **limits)
+
+    # Waypoints every seg_len full resolution voxels, the last coarse point is the end itself.
+    # The upsampled coarse points between two waypoints make up the corridor of that segment.
+    step = max(1, round(seg_len / max(factors)))
+    snap_radius = [max(1, ceil(f / 2)) for f in factors]
+    centers = [
+        [min(int(c * f + f // 2), size - 1) for c, f, size in zip(p, factors, image.shape)]
+        for p in coarse_path[:-1]
+    ]
+    waypoints = [list(map(int, start))]
+    corridors = [[]]
+    for i, center in enumerate(centers):
+        corridors[-1].append(center)
+        if (i + 1) % step == 0:
+            point = _snap_to_signal(image, center, snap_radius)
+            if point != waypoints[-1]:
+                waypoints.append(point)
+                corridors.append([])
+    if list(map(int, end)) != waypoints[-1]:
+        waypoints.append(list(map(int, end)))
     else:
-        tracer = AstarSingle(start, end, coords, is_soma, xy_extension, z_extension, res, tracing_sensitivity=tracing_sensitivity)
-    t1 = time()
-    path = tracer.get_trace()
-    t2 = time()
-    print("Astar time: ", t2 - t1)
-    
-    if len(path) == 0: return
-
-    if res > 0:
-        print("low res found")
-        path_length = len(path)
-        trace_count = max(2, ceil(path_length * (pow(2, res)) / seg_len))
-        
-        trace_index = ceil(path_length / trace_count)
-
-        ongoing_traces = []
-
-        for i in range(trace_count):
-            start_index = int(i * trace_index)
-            end_index = min(int((i + 1) * trace_index), path_length - 1)
-
-            if(start_index >= len(path)):
-                break
-
-            start_coords = tuple([path[start_index][0], path[start_index][1], path[start_index][2]])
-            end_coords = tuple([path[end_index][0], path[end_index][1], path[end_index][2]])
-
-            start_coords = mean_shift(coords, start_coords, is_multi, 2, pow(2, res))
-            end_coords = mean_shift(coords, end_coords, is_multi, 2, pow(2, res))
-
-            ongoing_traces.append(multiprocessing.Process(target = traceThread, name = " sub" + str(i), args = (rtrn, str(i), coords, start_coords, end_coords, is_soma, xy_extension, z_extension, 0, seg_len, tracing_sensitivity, is_multi)))
-            ongoing_traces[i].start()
-    
-        for trace in ongoing_traces:
-            trace.join(10)
-            if trace.is_alive(): return
-
-        path = []
-        for i in range(trace_count):
-            if not(str(i) in rtrn): 
-                return
-            path += rtrn[str(i)]
-            if thread_ind:
-                segment = rtrn[str(i)][-1]
-                segment[1] += 10
-                path += [segment]
-        rtrn[name] = path
-        print("threads: ", trace_count)
-        return
-
-    rtrn[name] = path
+        corridors.pop()
+
+    radius = (
+        min(xy_extension, 2 * ceil(max(factors[0], factors[1]))),
+        min(z_extension, 2 * ceil(factors[2])),
+    )
+    # segments stop short with TraceInterrupted instead of a partial path, so no gap is stitched in
+    partial = limits.pop("partial", False)
+    futures = [
+        (executor or default_refine_executor()).submit(
+            get_trace, coords, a, b, is_multi, is_soma, tracing_sensitivity=tracing_sensitivity,
+            corridor=Corridor(corridor, radius), cancel=cancel, **limits,
+        )
+        for a, b, corridor in zip(waypoints[:-1], waypoints[1:], corridors)
+    ]
+    segments = []
+    for future in futures:
+        try:
+            segments.append(future.result())
+        except TraceInterrupted:
+            for pending in futures:
+                pending.cancel()
+            if not partial:
+                raise
+            break
+    adjacent = [max(abs(a - b) for a, b in zip(p, q)) <= 1 for p, q in zip(waypoints[:-1], waypoints[1:])]
+    if any(len(segment) == 0 and not next_to for segment, next_to in zip(segments, adjacent)):
+        print("Corridor refinement failed, tracing the full bounding box")
+        return get_trace(coords, start, end, is_multi, is_soma, xy_extension, z_extension, tracing_sensitivity=tracing_sensitivity, cancel=cancel, partial=partial, **limits)
+
+    # Like the segments, the path leaves out start and end but keeps the waypoints in between
+    path = []
+    for segment, waypoint in zip(segments, waypoints[1:]):
+        path += segment + [waypoint]
+    return path if len(segments) < len(futures) else path[:-1]
 
 
 # def astar_color(img, start, end, is_soma=False, xy_extension=21, z_extension=7):
@@ -178,6 +388,6 @@ def traceThread(rtrn, name, coords, start, end, is_soma, xy_extension, z_extensi
 
 def mean_shift(coords, s, server_url, is_multi, xy_radius=2, z_radius=2, z_max = 2, iterations=None):
     start = [round(c) for c in s]
-    res = requests.get(f"{server_url}meanshift/brainbow_test/{start[0]},{start[1]},{start[2]}")
-    return [int(x) for x in res.text.split(',')]
+    res = requests.get(f"{server_url}meanshift/brainbow_test/{start[0]},{start[1]},{start[2]}", headers={"Accept": ACCEPT_POINTS})
+    return decode_points(res.content, res.headers.get("Content-Type"))[0].tolist()
     
@@ -0,0 +1,110 @@
+"""Unidirectional versus bidirectional A* on long synthetic neurites, and
+cached versus uncached multichannel traces.
+
+Needs the compiled extension (python compile_cython.py build_ext --inplace).
+Run from the backend directory:
+    python -m benchmarks.bench_astar
+"""
+
+from time import time
+
+import numpy
+
+from algorithm.astar.AstarWrapper import AstarWrapper
+from algorithm.astar.cost_volume import CostVolumeCache
+
+TRACE_LENGTHS = (50, 100, 200, 400)
+CHANNEL_COUNTS = (3, 4)  # RGB, and brainbow data with a fourth channel
+SIGNAL_LEVELS = (1000, 200)  # mean tube intensity over a background of 60
+REPEATS = 3
+
+
+def synthetic_tube(length: int, signal: int, radius: float = 2.0) -> tuple[numpy.ndarray, tuple, tuple]:
+    """Bright wavy tube along x through a dim, noisy volume
+
+    Returns:
+        volume, start, end
+    """
+    rng = numpy.random.default_rng(length)
+    shape = (length + 20, 80, 40)
+    volume = rng.poisson(60, size=shape).astype(numpy.uint16)
+
+    x = numpy.arange(10, length + 10)
+    y = 40 + 12 * numpy.sin(x / 25.0)
+    z = 20 + 6 * numpy.cos(x / 35.0)
+    _, ys, zs = numpy.meshgrid(0, numpy.arange(shape[1]), numpy.arange(shape[2]), indexing="ij")
+    for xi, yi, zi in zip(x, y, z):
+        inside = (ys[0] - yi) ** 2 + (zs[0] - zi) ** 2 <= radius**2
+        volume[xi][inside] = rng.poisson(signal, size=inside.sum())
+
+    start = (int(x[0]), int(round(y[0])), int(round(z[0])))
+    end = (int(x[-1]), int(round(y[-1])), int(round(z[-1])))
+    return volume, start, end
+
+
+def bench(volume, start, end, bidirectional: bool) -> tuple[float, int, int]:
+    tracer = AstarWrapper(bidirectional=bidirectional)
+    path = tracer.get_trace(start, end, volume)  # warm the search buffers
+
+    t0 = time()
+    for _ in range(REPEATS):
+        path = tracer.get_trace(start, end, volume)
+    return (time() - t0) / REPEATS, tracer.nodes_expanded, len(path)
+
+
+def synthetic_multichannel_tube(length: int, channels: int) -> tuple[numpy.ndarray, tuple, tuple]:
+    """`synthetic_tube` as the first channel of a colored tube
+
+    Returns:
+        volume, start, end
+    """
+    volume, start, end = synthetic_tube(length, 1000)
+    rng = numpy.random.default_rng(channels)
+    colored = rng.poisson(60, size=volume.shape + (channels,)).astype(numpy.uint16)
+    inside = volume > 300
+    colored[inside, 0] = volume[inside]
+    colored[inside, 1] = volume[inside] // 3
+    colored[inside, 2] = volume[inside] // 8
+    return colored, start, end
+
+
+def bench_cached(volume, start, end) -> tuple[float, float, bool]:
+    """Mean time of an uncached and of a cached multichannel trace, and whether their paths match"""
+    tracer = AstarWrapper(is_multi=True)
+    cache = CostVolumeCache()
+    cached = tracer.get_trace(start, end, volume, cost_cache=cache)  # fills the cache
+
+    t0 = time()
+    for _ in range(REPEATS):
+        uncached = tracer.get_trace(start, end, volume)
+    t1 = time()
+    for _ in range(REPEATS):
+        cached = tracer.get_trace(start, end, volume, cost_cache=cache)
+    t2 = time()
+    return (t1 - t0) / REPEATS, (t2 - t1) / REPEATS, cached == uncached
+
+
+def main():
+    for signal in SIGNAL_LEVELS:
+        print(f"tube intensity {signal}")
+        print(f"{'length':>6}  {'mode':<14} {'expanded':>10} {'time (ms)':>10} {'path':>6}")
+        for length in TRACE_LENGTHS:
+            volume, start, end = synthetic_tube(length, signal)
+            uni = bench(volume, start, end, bidirectional=False)
+            bi = bench(volume, start, end, bidirectional=True)
+            for name, (dt, expanded, path_length) in (("unidirectional", uni), ("bidirectional", bi)):
+                print(f"{length:>6}  {name:<14} {expanded:>10} {dt * 1000:>10.1f} {path_length:>6}")
+            print(f"{'':>6}  {'ratio':<14} {bi[1] / uni[1]:>10.2f} {bi[0] / uni[0]:>10.2f}")
+        print()
+
+    print("multichannel, cost volume cache")
+    print(f"{'channels':>8} {'length':>6} {'uncached (ms)':>14} {'cached (ms)':>12} {'same path':>10}")
+    for channels in CHANNEL_COUNTS:
+        for length in TRACE_LENGTHS[:2]:
+            volume, start, end = synthetic_multichannel_tube(length, channels)
+            uncached, cached, same = bench_cached(volume, start, end)
+            print(f"{channels:>8} {length:>6} {uncached * 1000:>14.1f} {cached * 1000:>12.1f} {str(same):>10}")
+
+
+if __name__ == "__main__":
+    main()
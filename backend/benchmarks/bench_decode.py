@@ -0,0 +1,102 @@
+"""Throughput of the CdnArray chunk decode path.
+
+Run from the backend directory:
+    python -m benchmarks.bench_decode
+"""
+
+import gzip
+from time import time
+
+import numpy
+
+from cdn.encodings import decode_chunk, zstandard
+
+CHUNK_SHAPE = (64, 64, 64, 4)  # x, y, z, channel; a 4-channel brainbow chunk
+REPEATS = 20
+
+
+def synthetic_chunk(shape=CHUNK_SHAPE) -> numpy.ndarray:
+    """Smooth background plus shot noise, roughly as compressible as real data"""
+    rng = numpy.random.default_rng(0)
+    x, y, z, c = shape
+    grid = numpy.add.outer(numpy.add.outer(numpy.arange(x), numpy.arange(y)), numpy.arange(z))
+    background = (200 + 50 * numpy.sin(grid / 16.0))[..., None]
+    return (background + rng.poisson(20, size=shape)).astype(numpy.uint16)
+
+
+def encode_compressed_segmentation(chunk: numpy.ndarray, block_size=(8, 8, 8)) -> bytes:
+    """Minimal encoder, only used to produce benchmark input"""
+    x, y, z, c = chunk.shape
+    bx, by, bz = block_size
+    grid = [-(-x // bx), -(-y // by), -(-z // bz)]
+    out = [0] * c
+    for channel in range(c):
+        base = len(out)
+        out[channel] = base
+        headers_at = len(out)
+        out.extend([0] * (2 * grid[0] * grid[1] * grid[2]))
+        block = 0
+        for gz in range(grid[2]):
+            for gy in range(grid[1]):
+                for gx in range(grid[0]):
+                    values = numpy.zeros((bx, by, bz), dtype=numpy.uint32)
+                    sub = chunk[gx * bx:(gx + 1) * bx, gy * by:(gy + 1) * by, gz * bz:(gz + 1) * bz, channel]
+                    values[: sub.shape[0], : sub.shape[1], : sub.shape[2]] = sub
+                    table, indices = numpy.unique(values.T.reshape(-1), return_inverse=True)
+                    bits = next(b for b in (0, 1, 2, 4, 8, 16, 32) if len(table) <= (1 << b))
+                    values_offset = len(out) - base
+                    if bits > 0:
+                        per_word = 32 // bits
+                        padded = numpy.zeros(-(-len(indices) // per_word) * per_word, dtype=numpy.uint64)
+                        padded[: len(indices)] = indices
+                        shifts = numpy.arange(per_word, dtype=numpy.uint64) * bits
+                        words = (padded.reshape(-1, per_word) << shifts).sum(axis=1)
+                        out.extend(int(w) for w in words)
+                    table_offset = len(out) - base
+                    out.extend(int(v) for v in table)
+                    out[headers_at + 2 * block] = table_offset | (bits << 24)
+                    out[headers_at + 2 * block + 1] = values_offset
+                    block += 1
+    return numpy.array(out, dtype="<u4").tobytes()
+
+
+def bench(name, data: bytes, content_encoding, encoding, dtype, expected):
+    shape = expected.shape
+    result = decode_chunk(data, content_encoding, encoding, shape, dtype)
+    assert (result == expected).all(), f"{name} decoded incorrectly"
+
+    start = time()
+    for _ in range(REPEATS):
+        decode_chunk(data, content_encoding, encoding, shape, dtype)
+    dt = (time() - start) / REPEATS
+
+    print(
+        f"{name:<28} {len(data) / 1e6:8.2f} MB on wire  "
+        f"{expected.nbytes / len(data):5.2f}x  {expected.nbytes / dt / 1e6:9.1f} MB/s decoded"
+    )
+
+
+def main():
+    chunk = synthetic_chunk()
+    raw = numpy.ascontiguousarray(chunk.T).tobytes()
+
+    bench("raw", raw, None, "raw", numpy.uint16, chunk)
+    bench("raw + gzip", gzip.compress(raw, compresslevel=6), "gzip", "raw", numpy.uint16, chunk)
+    if zstandard is not None:
+        bench("raw + zstd", zstandard.ZstdCompressor(level=3).compress(raw), "zstd", "raw", numpy.uint16, chunk)
+    else:
+        print("raw + zstd                   skipped, zstandard is not installed")
+
+    labels = (chunk // 64).astype(numpy.uint32)
+    bench(
+        "compressed_segmentation",
+        encode_compressed_segmentation(labels),
+        None,
+        "compressed_segmentation",
+        numpy.uint32,
+        labels,
+    )
+
+
+if __name__ == "__main__":
+    main()
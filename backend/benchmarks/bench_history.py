@@ -0,0 +1,114 @@
+"""Undo log versus deep copied undo history.
+
+Builds datasets of synthetic neurons, then times single-neuron edits and
+their undo, and measures the memory the history holds per edit. Run from the backend
+directory:
+    python -m benchmarks.bench_history
+"""
+
+import tracemalloc
+from copy import deepcopy
+from time import time
+
+from ngauge import Neuron
+from ngauge import TracingPoint as TP
+
+from ntracer.helpers.tracing_data_helper import (
+    Action,
+    ActionType,
+    Coords,
+    NeuronState,
+)
+
+NEURON_COUNTS = (100, 1000)
+BRANCHES = 4
+BRANCH_LENGTH = 100
+EDITS = 10
+
+
+class DeepCopyCoords(Coords):
+    """History as it was first kept, a deep copy of every neuron per state"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.snapshots = []
+
+    def new_state(self):
+        new_coord = NeuronState()
+        new_coord.neuron_dict = deepcopy(self.roots.neuron_dict)
+        new_coord.branched_dict = deepcopy(self.roots.branched_dict)
+        new_coord.dashboard_state = deepcopy(self.roots.dashboard_state)
+        new_coord.owned = set(new_coord.neuron_dict.keys())
+        self.snapshots.append(self.roots)
+        self.roots = new_coord
+
+    def undo(self):
+        self.roots = self.snapshots.pop()
+
+
+def synthetic_neuron(seed: int) -> Neuron:
+    neuron = Neuron()
+    for b in range(BRANCHES):
+        root = current = TP(seed, b, 0, 1, 2)
+        for i in range(1, BRANCH_LENGTH):
+            point = TP(seed, b, i, 1, 2)
+            current.add_child(point)
+            current = point
+        neuron.add_branch(root)
+    return neuron
+
+
+def make_coords(cls, neuron_count: int) -> Coords:
+    coords = cls(None, None, [])
+    for neuron_id in range(neuron_count):
+        coords.roots[neuron_id] = synthetic_neuron(neuron_id)
+    return coords
+
+
+def edit(coords: Coords, neuron_id: int):
+    """Extend the first branch of a neuron by one point, as a trace would"""
+    coords.new_state()
+    coords.roots.actions.append(Action(ActionType.MODIFY_NEURON, neuron_id))
+    branch = coords.roots[neuron_id].branches[0]
+    while branch.children:
+        branch = branch.children[0]
+    branch.add_child(TP(branch.x, branch.y, branch.z + 1, 1, 2))
+
+
+def bench(cls, neuron_count: int) -> tuple[float, float, float]:
+    """Mean time of an edit and of its undo, and memory the history holds per edit
+
+    Returns:
+        ms, ms, MiB
+    """
+    coords = make_coords(cls, neuron_count)
+    start = time()
+    for i in range(EDITS):
+        edit(coords, i % neuron_count)
+    elapsed = (time() - start) / EDITS
+
+    start = time()
+    for _ in range(EDITS):
+        coords.undo()
+    undo_elapsed = (time() - start) / EDITS
+
+    tracemalloc.start()  # slows allocations down, so timed separately
+    base = tracemalloc.get_traced_memory()[0]
+    for i in range(EDITS):
+        edit(coords, i % neuron_count)
+    held = (tracemalloc.get_traced_memory()[0] - base) / EDITS
+    tracemalloc.stop()
+    return elapsed * 1000, undo_elapsed * 1000, held / 2**20
+
+
+def main():
+    print(f"Edits of one neuron, {BRANCHES} x {BRANCH_LENGTH} points per neuron")
+    print(f"{'neurons':>8} {'history':>10} {'ms/edit':>9} {'ms/undo':>9} {'MiB/edit':>9}")
+    for neuron_count in NEURON_COUNTS:
+        for name, cls in (("deep copy", DeepCopyCoords), ("undo log", Coords)):
+            ms, undo_ms, mib = bench(cls, neuron_count)
+            print(f"{neuron_count:>8} {name:>10} {ms:>9.2f} {undo_ms:>9.3f} {mib:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Text versus binary points responses of the tracing service.
+
+Serves synthetic traces from the stand-in CDN server and times the request
+plus decode for each response format. Run from the backend directory:
+    python -m benchmarks.bench_points
+"""
+
+from time import time
+
+import numpy
+import requests
+
+from cdn.point_encoding import POINTS_BINARY, POINTS_MSGPACK, POINTS_TEXT, decode_points, msgpack
+from cdn.standin_server import StandinCdnServer
+
+TRACE_LENGTHS = (100, 1000, 10000)
+REPEATS = 20
+
+
+def legacy_decode(text: str) -> list:
+    return [[int(p) for p in x.split(",")] for x in text.split("\n")[:-1]]
+
+
+class TraceServer(StandinCdnServer):
+    """Answers every trace with a fixed path instead of searching"""
+
+    def __init__(self, path):
+        super().__init__(numpy.zeros((1, 1, 1), dtype=numpy.uint16))
+        self.path = path
+
+    def trace(self, start, end, is_soma):
+        return self.path
+
+
+def bench(session, url, accept, legacy=False) -> float:
+    start = time()
+    for _ in range(REPEATS):
+        response = session.get(url, headers={"Accept": accept})
+        if legacy:
+            legacy_decode(response.text)
+        else:
+            decode_points(response.content, response.headers.get("Content-Type"))
+    return (time() - start) / REPEATS
+
+
+def main():
+    formats = [("text, legacy parser", POINTS_TEXT, True), ("text", POINTS_TEXT, False), ("binary", POINTS_BINARY, False)]
+    if msgpack is not None:
+        formats.append(("msgpack", POINTS_MSGPACK, False))
+
+    print(f"{'points':>6}  {'format':<20} {'ms':>8}")
+    for length in TRACE_LENGTHS:
+        path = numpy.cumsum(numpy.random.default_rng(length).integers(-1, 2, size=(length, 3)), axis=0) + 5000
+        with TraceServer(path) as server, requests.Session() as session:
+            url = f"{server.url}/{server.dataset_id}/tracing/0,0,0/1,1,1"
+            for name, accept, legacy in formats:
+                print(f"{length:>6}  {name:<20} {bench(session, url, accept, legacy) * 1000:>8.2f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
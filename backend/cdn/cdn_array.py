@@ -1,24 +1,87 @@
+import asyncio
 import collections
+import math
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from io import UnsupportedOperation
 import numpy
-import urllib
-import json
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 import time
 import posixpath
+from cdn.chunk_cache import ChunkCache, DEFAULT_CACHE_BYTES
+from cdn.metadata import load_info
+from cdn.encodings import ACCEPT_ENCODING, SUPPORTED_ENCODINGS, decode_chunk
+from cdn.disk_cache import DiskChunkCache, DEFAULT_DISK_CACHE_BYTES, dataset_cache_key
 from ntracer.utils.timing import print_time
 
 LOGGER_TAG = "CDN"
+DEFAULT_CHUNK_SIZE = (64, 64, 64)
+DEFAULT_FETCH_WORKERS = 8
 
 @print_time(LOGGER_TAG)
 def download_raw(session: requests.Session, res: int, params: list, url: str):
+    """Download one subvolume, still in its transfer encoding
+
+    Returns:
+        params, content, download time and the Content-Encoding of `content`
+    """
+    (x1, x2), (y1, y2), (z1, z2) = params
+
+    s_time = time.time()
+    response = session.get(
+        posixpath.join(url, str(res), f"{x1}-{x2}_{y1}-{y2}_{z1}-{z2}"),
+        headers={"Accept-Encoding": ACCEPT_ENCODING},
+        stream=True,
+    )
+    if response.status_code != 200:
+        response.close()
+        raise ConnectionError(f"download_raw failed: http status code: {response.status_code}")
+    # decoded by the caller straight into the chunk buffer
+    content = response.raw.read(decode_content=False)
+    dt = time.time() - s_time
+    return params, content, dt, response.headers.get("Content-Encoding")
+
+@print_time(LOGGER_TAG)
+async def download_raw_async(session: httpx.AsyncClient, res: int, params: list, url: str):
     (x1, x2), (y1, y2), (z1, z2) = params
 
     s_time = time.time()
-    response = requests.get(f"{url}{res}/{x1}-{x2}_{y1}-{y2}_{z1}-{z2}")
-    content = response.content
+    async with session.stream(
+        "GET",
+        posixpath.join(url, str(res), f"{x1}-{x2}_{y1}-{y2}_{z1}-{z2}"),
+        headers={"Accept-Encoding": ACCEPT_ENCODING},
+    ) as response:
+        if response.status_code != 200:
+            raise ConnectionError(f"download_raw_async failed: http status code: {response.status_code}")
+        content = b"".join([part async for part in response.aiter_raw()])
     dt = time.time() - s_time
-    return params, content, dt
+    return params, content, dt, response.headers.get("Content-Encoding")
+
+@dataclass
+class CdnRegion:
+    """Voxels of a physical bounding box read at an automatically chosen scale"""
+
+    data: numpy.ndarray
+    res_key: int
+    resolution: tuple
+    """Physical size of one voxel of `data`"""
+    offset: tuple[int, int, int]
+    """Voxel coordinates, at this scale, of data[0, 0, 0]"""
+    downsample: tuple[float, float, float]
+    """Size of one voxel of `data` in voxels of the highest resolution"""
+
+    def to_base_voxels(self, points) -> numpy.ndarray:
+        """Map indexes into `data` to voxel coordinates of the highest resolution"""
+        points = numpy.asarray(points, dtype=float)
+        return (points + self.offset) * self.downsample
+
+    def from_base_voxels(self, points) -> numpy.ndarray:
+        """Map highest resolution voxel coordinates to indexes into `data`"""
+        points = numpy.asarray(points, dtype=float)
+        return numpy.floor(points / self.downsample).astype(int) - self.offset
+
 
 class CdnArray:
     class CdnResolutionItem:
@@ -31,9 +94,76 @@ class CdnArray:
             self._shape = tuple([*self._size, self.parent.channel_count])
             self.drop_channel_dim = drop_channel_dim
             self.session = session
-            self.dtype=numpy.uint16
+            self.dtype = numpy.dtype(self.parent.dtype_raw)
+
+            scale = self.parent.scales[self.parent_i]
+            chunk_sizes = scale.get("chunk_sizes") or [DEFAULT_CHUNK_SIZE]
+            self.chunk_size = tuple(map(int, chunk_sizes[0]))
+            self.encoding = scale.get("encoding", "raw")
+            if self.encoding not in SUPPORTED_ENCODINGS:
+                raise ValueError(f"Unsupported chunk encoding: {self.encoding}")
+            self.block_size = scale.get("compressed_segmentation_block_size")
 
         def __getitem__(self, key) -> numpy.ndarray:
+            bounds, channel_selector = self._parse_key(key)
+            return self._select_channels(self._read(bounds), channel_selector)
+
+        class AsyncIndexer:
+            """Slicing proxy so `await item.aget[x1:x2, y1:y2, z1:z2]` reads without blocking"""
+
+            def __init__(self, item):
+                self.item = item
+
+            def __getitem__(self, key):
+                return self.item.aread(key)
+
+        @property
+        def aget(self) -> "CdnArray.CdnResolutionItem.AsyncIndexer":
+            return self.AsyncIndexer(self)
+
+        async def aread(self, key) -> numpy.ndarray:
+            return (await self.agather([key]))[0]
+
+        async def agather(self, keys: list) -> list[numpy.ndarray]:
+            """Read many slices at once, downloading each missing chunk only once"""
+            parsed = [self._parse_key(key) for key in keys]
+            indices = list(dict.fromkeys(
+                index for bounds, _ in parsed for index in self._chunk_indices(bounds)
+            ))
+
+            # disk reads, decoding and disk writes run on the fetch workers, off the event loop
+            loop = asyncio.get_running_loop()
+            chunks = {}
+            uncached = []
+            for index in indices:
+                chunk = self.parent.cache.get((self.res_key, index))
+                if chunk is None:
+                    uncached.append(index)
+                else:
+                    chunks[index] = chunk
+            looked_up = [None] * len(uncached)
+            if self.parent.disk_cache is not None:
+                looked_up = await asyncio.gather(*[
+                    loop.run_in_executor(self.parent.executor, self._lookup_disk, index) for index in uncached
+                ])
+            chunks.update((index, chunk) for index, chunk in zip(uncached, looked_up) if chunk is not None)
+            missing = [index for index, chunk in zip(uncached, looked_up) if chunk is None]
+
+            fetched = await asyncio.gather(*[self._fetch_chunk_async(index) for index in missing])
+            chunks.update(zip(missing, fetched))
+
+            return [
+                self._select_channels(self._assemble(bounds, chunks), channel_selector)
+                for bounds, channel_selector in parsed
+            ]
+
+        def _select_channels(self, result: numpy.ndarray, channel_selector: range) -> numpy.ndarray:
+            result = result[..., channel_selector.start:channel_selector.stop]
+            if self.drop_channel_dim:
+                result = result[..., 0]
+            return result
+
+        def _parse_key(self, key) -> tuple[list[tuple[int, int]], range]:
             key = list(key)
             if (len(self._size) != len(key)) and (len(self._shape) != len(key)):
                 raise NotImplementedError(
@@ -45,42 +175,135 @@ class CdnArray:
                     key[i] = slice(key[i], key[i] + 1)
                 start = 0 if (key[i].start is None) else key[i].start
                 end = self._shape[i] if (key[i].stop is None) else key[i].stop
-                key[i] = range(start, end)
+                key[i] = range(max(start, 0), min(end, self._shape[i]))
 
             channel_selector = range(0, self._shape[-1])
             if len(key) == len(self._shape):  # channel specified
                 channel_selector = key.pop(-1)
 
-            params = [[k.start, k.stop] for k in key[:3]]
-            ((x1, x2), (y1, y2), (z1, z2)) = params
-            _, dl_result, t = download_raw(self.session, self.res_key, params, self.parent.url)
+            bounds = [(k.start, max(k.start, k.stop)) for k in key[:3]]
+            return bounds, channel_selector
+
+        def _chunk_indices(self, bounds) -> list[tuple[int, int, int]]:
+            """Indices of all chunks on the native grid that overlap `bounds`"""
+            ranges = [
+                range(lo // cs, (hi - 1) // cs + 1) if hi > lo else range(0)
+                for (lo, hi), cs in zip(bounds, self.chunk_size)
+            ]
+            return [(cx, cy, cz) for cx in ranges[0] for cy in ranges[1] for cz in ranges[2]]
 
-            # load buffer into numpy uint16 type
-            dl_result = numpy.frombuffer(dl_result, dtype=numpy.uint16)
+        def _chunk_bounds(self, index) -> list[tuple[int, int]]:
+            return [
+                (c * cs, min((c + 1) * cs, size))
+                for c, cs, size in zip(index, self.chunk_size, self._size)
+            ]
 
-            # The subvolume data for the chunk is stored directly in little-endian binary format in [x, y, z, channel];
+        def _copy_chunk(self, out: numpy.ndarray, bounds, index, chunk: numpy.ndarray):
+            """Copy the overlap of a chunk with `bounds` into the output buffer"""
+            src, dst = [], []
+            for (lo, hi), (c_lo, c_hi) in zip(bounds, self._chunk_bounds(index)):
+                o_lo, o_hi = max(lo, c_lo), min(hi, c_hi)
+                src.append(slice(o_lo - c_lo, o_hi - c_lo))
+                dst.append(slice(o_lo - lo, o_hi - lo))
+            out[tuple(dst)] = chunk[tuple(src)]
+
+        def _decode(self, raw: bytes, content_encoding: str | None, bounds) -> numpy.ndarray:
+            # Raw subvolume data for the chunk is stored directly in little-endian binary format in [x, y, z, channel];
             # Fortran order (i.e. consecutive x values are contiguous)
             #                          Z              Y              X             CH
             # uint16_t out_buffer[channel_count][chunk_sizes[2]][chunk_sizes[1]][chunk_sizes[0]];
+            shape = (*[hi - lo for lo, hi in bounds], self._shape[-1])
+            return decode_chunk(
+                raw, content_encoding, self.encoding, shape, self.dtype, self.block_size
+            )
 
-            # define buffer using server code definitions
-            if (self.drop_channel_dim):
-                shape = (
-                    z2 - z1,
-                    y2 - y1,
-                    x2 - x1,
-                )
-            else:
-                shape = (
-                    channel_selector.stop - channel_selector.start,
-                    z2 - z1,
-                    y2 - y1,
-                    x2 - x1,
-                )
+        def _fetch_chunk(self, index) -> numpy.ndarray:
+            bounds = self._chunk_bounds(index)
+            _, raw, _, content_encoding = download_raw(
+                self.session, self.res_key, bounds, self.parent.url
+            )
+            return self._store_chunk(index, bounds, raw, content_encoding)
+
+        async def _fetch_chunk_async(self, index) -> numpy.ndarray:
+            bounds = self._chunk_bounds(index)
+            _, raw, _, content_encoding = await download_raw_async(
+                self.parent.async_session, self.res_key, bounds, self.parent.url
+            )
+            return await asyncio.get_running_loop().run_in_executor(
+                self.parent.executor, self._store_chunk, index, bounds, raw, content_encoding
+            )
+
+        def _store_chunk(self, index, bounds, raw: bytes, content_encoding: str | None) -> numpy.ndarray:
+            chunk = self._decode(raw, content_encoding, bounds)
+            self.parent.cache.put((self.res_key, index), chunk, fetched_bytes=len(raw))
+            if self.parent.disk_cache is not None:
+                self.parent.disk_cache.put(self.res_key, index, chunk)
+            return chunk
+
+        def prefetch_chunk(self, index) -> bool:
+            """Make sure a chunk is cached; True if it had to be downloaded"""
+            if (self.res_key, index) in self.parent.cache:
+                return False
+            if self._lookup_disk(index, record_stats=False) is not None:
+                return False
+            self._fetch_chunk(index)
+            return True
+
+        def _lookup_chunk(self, index) -> numpy.ndarray | None:
+            """Find a chunk in memory, then on disk; None if it must be downloaded"""
+            chunk = self.parent.cache.get((self.res_key, index))
+            if chunk is None:
+                chunk = self._lookup_disk(index)
+            return chunk
+
+        def _lookup_disk(self, index, record_stats: bool = True) -> numpy.ndarray | None:
+            """Load a chunk from the disk cache into memory; None if it is not there"""
+            if self.parent.disk_cache is None:
+                return None
+            chunk = self.parent.disk_cache.get(self.res_key, index, record_stats)
+            if chunk is not None:
+                self.parent.cache.put((self.res_key, index), chunk)
+            return chunk
+
+        def _empty(self, bounds) -> numpy.ndarray:
+            return numpy.empty(
+                (*[hi - lo for lo, hi in bounds], self._shape[-1]),
+                dtype=self.dtype,
+                order="F",
+            )
+
+        def _assemble(self, bounds, chunks: dict) -> numpy.ndarray:
+            out = self._empty(bounds)
+            for index in self._chunk_indices(bounds):
+                self._copy_chunk(out, bounds, index, chunks[index])
+            return out
+
+        def _read(self, bounds) -> numpy.ndarray:
+            """Assemble `bounds` from cached chunks, downloading only the missing ones"""
+            out = self._empty(bounds)
+
+            missing = []
+            for index in self._chunk_indices(bounds):
+                chunk = self._lookup_chunk(index)
+                if chunk is None:
+                    missing.append(index)
+                else:
+                    self._copy_chunk(out, bounds, index, chunk)
 
-            dl_result = dl_result.reshape(shape)
+            if len(missing) == 1:
+                self._copy_chunk(out, bounds, missing[0], self._fetch_chunk(missing[0]))
+            elif len(missing) > 1:
+                # each chunk lands in a disjoint region of `out`, so workers write directly
+                futures = [
+                    self.parent.executor.submit(
+                        lambda i: self._copy_chunk(out, bounds, i, self._fetch_chunk(i)), index
+                    )
+                    for index in missing
+                ]
+                for future in futures:
+                    future.result()
 
-            return dl_result.T
+            return out
 
         def __repr__(self) -> str:
             return "<cdn_array.cdn_resolution_item parent={} resolution_key={} resolution={} size={} {}>".format(
@@ -103,24 +326,41 @@ class CdnArray:
         self,
         url,
         drop_channel_dim=False,
+        cache_bytes=DEFAULT_CACHE_BYTES,
+        max_workers=DEFAULT_FETCH_WORKERS,
+        disk_cache_dir=None,
+        disk_cache_bytes=DEFAULT_DISK_CACHE_BYTES,
+        metadata=None,
     ):
 
         self.url = url
         self.res_cache = dict()
         self.session = requests.Session()
+        # keep-alive connections for every fetch worker
+        adapter = HTTPAdapter(
+            pool_connections=max_workers, pool_maxsize=max_workers
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="cdn_fetch"
+        )
+        self.async_session = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_workers, max_keepalive_connections=max_workers)
+        )
+        self.cache = ChunkCache(max_bytes=cache_bytes)
+        self.disk_cache = None
+        if disk_cache_dir:
+            self.disk_cache = DiskChunkCache(
+                disk_cache_dir, dataset_cache_key(url), max_bytes=disk_cache_bytes
+            )
 
-        info_url = posixpath.join(self.url, "info")
-        try:
-            response = urllib.request.urlopen(info_url)
-            self.metadata = json.loads(response.read())
-        except Exception as e:
-            raise ConnectionError(f"Failed to load metadata from URL: {info_url}")
+        self.metadata = metadata if metadata is not None else load_info(self.url)
 
         try:
             self.channel_count = int(self.metadata["num_channels"])
             self.dtype_raw = self.metadata["data_type"]
-            self.scales = self.metadata["scales"]
-            self.scales.sort(key=lambda x: int(x["key"]))
+            self.scales = sorted(self.metadata["scales"], key=lambda x: int(x["key"]))
             self.resolution_keys = [int(i["key"]) for i in self.scales]
             self.resolutions = [tuple(map(int, i["resolution"])) for i in self.scales]
             self.sizes = [tuple(map(int, i["size"])) for i in self.scales]
@@ -157,3 +397,52 @@ class CdnArray:
 
     def keys(self) -> list:
         return self.resolution_keys
+
+    def voxel_bounds(self, i: int, bbox) -> list[tuple[int, int]]:
+        """Voxel bounds, at scale `i`, covering a physical bounding box"""
+        return [
+            (max(0, math.floor(lo / res)), min(size, math.ceil(hi / res)))
+            for (lo, hi), res, size in zip(bbox, self.resolutions[i], self.sizes[i])
+        ]
+
+    def select_scale(self, bbox, max_voxels: int) -> int:
+        """Index of the finest scale at which `bbox` fits in `max_voxels`
+
+        Falls back to the coarsest scale when no scale is small enough.
+        """
+        for i in range(len(self.scales)):
+            count = math.prod(max(0, hi - lo) for lo, hi in self.voxel_bounds(i, bbox))
+            if count <= max_voxels:
+                return i
+        return len(self.scales) - 1
+
+    def get_region(self, bbox, max_voxels: int) -> CdnRegion:
+        """Read a physical bounding box at the finest scale within a voxel budget
+
+        Args:
+            bbox: ((x1, x2), (y1, y2), (z1, z2)) in the physical units of the info resolutions
+            max_voxels: largest number of voxels (per channel) to read
+
+        Returns:
+            CdnRegion
+        """
+        i = self.select_scale(bbox, max_voxels)
+        res_key = self.resolution_keys[i]
+        bounds = self.voxel_bounds(i, bbox)
+        data = self[res_key][tuple(slice(lo, hi) for lo, hi in bounds)]
+        return CdnRegion(
+            data=data,
+            res_key=res_key,
+            resolution=self.resolutions[i],
+            offset=tuple(lo for lo, _ in bounds),
+            downsample=tuple(
+                r / r0 for r, r0 in zip(self.resolutions[i], self.resolutions[0])
+            ),
+        )
+
+    def cache_stats(self) -> dict:
+        stats = self.cache.get_stats()
+        if self.disk_cache is not None:
+            stats["disk"] = self.disk_cache.get_stats()
+        return stats
+
@@ -1,5 +1,8 @@
 ## May need to be run: export LIBMYSQL_ENABLE_CLEARTEXT_PLUGIN=1
 
+import asyncio
+import hashlib
+
 import ngauge
 import numpy as np
 from time import time
@@ -7,16 +10,27 @@ import httpx
 from typing import Union
 from ngauge import Neuron
 import requests
+from cdn.neuron_sync import NeuronSync
 from ntracer.utils.timing import print_time
 
 key_location = "./"
 LOGGER_TAG = "CDN"
 
+
+def swc_digest(swc: str) -> str:
+    return hashlib.sha1(swc.encode()).hexdigest()
+
 class CdnHelper:
     def __init__(self, base_url) -> None:
          self.session = requests.Session()
          self.async_session = httpx.AsyncClient()
          self.base_url = base_url
+         self.synced: dict[int, str | None] = {}
+         """Digest of the SWC of every neuron on the server by local id, None if not known"""
+         self.server_ids: dict[int, int] = {}
+         """Server id of neurons added back under another id, by the id they keep locally"""
+         self.sync = NeuronSync(self)
+         self.sync.start()
 
     @print_time(LOGGER_TAG)
     def get_all_neurons(self, imageid: str | None = None):
@@ -24,18 +38,25 @@ class CdnHelper:
         if res.status_code != 200:
             raise Exception(f"get_all_neurons failed: http status code: {res.status_code}")
 
-        return [(int(neuronid), []) for neuronid in res.json()["neuronids"]]
+        neuronids = [int(neuronid) for neuronid in res.json()["neuronids"]]
+        for neuronid in neuronids:
+            self.synced.setdefault(neuronid, None)
+        return [(neuronid, []) for neuronid in neuronids]
+
 
+    def server_id(self, neuronid: int) -> int:
+        return self.server_ids.get(neuronid, neuronid)
 
     @print_time(LOGGER_TAG)
     async def get_swc(self, neuronid: int, as_neuron=False) -> Union[str, Neuron]:
-        res = await self.async_session.get(f"{self.base_url}/get/{neuronid}")
+        res = await self.async_session.get(f"{self.base_url}/get/{self.server_id(neuronid)}")
         if res.status_code != 200:
             raise Exception(
                 f"get_swc for `{neuronid}` failed: http status code: {res.status_code}"
             )
 
         swc = res.text
+        self.synced[neuronid] = swc_digest(swc)
         if as_neuron:
             swc = swc.split("\n")
             neuron = ngauge.Neuron.from_swc_text(swc)
@@ -44,15 +65,19 @@ class CdnHelper:
 
     @print_time(LOGGER_TAG)
     def delete_neuron(self, neuronid: int):
-        res = self.session.get(f"{self.base_url}/delete/{neuronid}")
+        self.sync.flush()
+        res = self.session.get(f"{self.base_url}/delete/{self.server_id(neuronid)}")
         if res.status_code != 200:
             raise Exception(
                 f"delete neuron '{neuronid}' failed: http status code: {res.status_code}"
             )
+        self.synced.pop(neuronid, None)
+        self.server_ids.pop(neuronid, None)
 
     @print_time(LOGGER_TAG)
     def add_neuron(self, toinsert: str, neuronid: Union[int, None] = None) -> int:
         # np.savetxt("new_neuron.swc", toinsert, delimiter=",", fmt="%d")
+        self.sync.flush()
         res = self.session.post(
             f"{self.base_url}/upload",
             files={"data": ("new_neuron.swc", bytes(toinsert, encoding="utf8"))},
@@ -64,24 +89,93 @@ class CdnHelper:
             )
 
         neuronid = (res.json())["neuronid"]
+        self.synced[int(neuronid)] = swc_digest(toinsert)  # type: ignore
         return neuronid # type: ignore
 
     @print_time(LOGGER_TAG)
     def replace_neuron(self, neuronid: int, neuron: Neuron):
         toadd = neuron.to_swc()
+        self.sync.flush()
         res = self.session.post(
-            f"{self.base_url}/replace/{neuronid}", files={"data": ("new_neuron.swc", toadd)} # type: ignore
+            f"{self.base_url}/replace/{self.server_id(neuronid)}", files={"data": ("new_neuron.swc", toadd)} # type: ignore
         )
         if res.status_code != 200:
             raise Exception(
                 f"replace neuron '${neuronid}' failed: http status code: {res.status_code}"
             )
+        self.synced[neuronid] = swc_digest(toadd)  # type: ignore
 
     @print_time(LOGGER_TAG)
     def update_neuron(self, neuronid: int, neuron: Neuron):
         self.replace_neuron(neuronid, neuron)
 
 
+    async def sync_neurons(self, neurons: dict[int, Neuron | None], client: httpx.AsyncClient) -> tuple[int, int, int]:
+        """Make the server copy of `neurons` match them, None deletes a neuron
+
+        Only neurons whose SWC differs from the copy last seen on the server
+        are sent, all requests at once on `client`.
+
+        Returns:
+            number of neurons sent, skipped as unchanged, and failed
+        """
+        pending = []
+        for neuronid, neuron in neurons.items():
+            if neuron is None:
+                if neuronid in self.synced:
+                    pending.append(self._adelete_neuron(client, neuronid))
+                continue
+
+            swc = neuron.to_swc()
+            if swc is None:
+                print(f"[{LOGGER_TAG}] Cannot convert neuron '{neuronid}' to swc")
+                continue
+            digest = swc_digest(swc)
+            if neuronid not in self.synced:
+                pending.append(self._aadd_neuron(client, neuronid, swc, digest))
+            elif self.synced[neuronid] != digest:
+                pending.append(self._areplace_neuron(client, neuronid, swc, digest))
+
+        results = await asyncio.gather(*pending, return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        for error in errors:
+            print(f"[{LOGGER_TAG}] {error}")
+        return len(pending) - len(errors), len(neurons) - len(pending), len(errors)
+
+    async def _adelete_neuron(self, client: httpx.AsyncClient, neuronid: int):
+        res = await client.get(f"{self.base_url}/delete/{self.server_id(neuronid)}")
+        if res.status_code != 200:
+            raise Exception(
+                f"delete neuron '{neuronid}' failed: http status code: {res.status_code}"
+            )
+        self.synced.pop(neuronid, None)
+        self.server_ids.pop(neuronid, None)
+
+    async def _aadd_neuron(self, client: httpx.AsyncClient, neuronid: int, swc: str, digest: str):
+        res = await client.post(
+            f"{self.base_url}/upload",
+            files={"data": ("new_neuron.swc", bytes(swc, encoding="utf8"))},
+        )
+        if res.status_code != 200:
+            raise Exception(
+                f"add neuron '{neuronid}' failed: http status code: {res.status_code}"
+            )
+        new_neuronid = int(res.json()["neuronid"])
+        self.synced[neuronid] = digest
+        if new_neuronid != neuronid:  # keeps its id locally, so the undo history still applies
+            self.server_ids[neuronid] = new_neuronid
+            print(f"[{LOGGER_TAG}] Neuron '{neuronid}' was added back as '{new_neuronid}'")
+
+    async def _areplace_neuron(self, client: httpx.AsyncClient, neuronid: int, swc: str, digest: str):
+        res = await client.post(
+            f"{self.base_url}/replace/{self.server_id(neuronid)}", files={"data": ("new_neuron.swc", swc)}
+        )
+        if res.status_code != 200:
+            raise Exception(
+                f"replace neuron '{neuronid}' failed: http status code: {res.status_code}"
+            )
+        self.synced[neuronid] = digest
+
     def get_point_from_coordinates(self, x, y, z):
         # cmd = exe("SELECT neuronid FROM swc WHERE x=%s AND y=%s AND z=%s", [x, y, z],)
         # res = cmd.fetchone()
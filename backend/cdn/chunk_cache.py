@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy
+
+DEFAULT_CACHE_BYTES = 1024 * 1024 * 1024  # 1 GiB
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    bytes_fetched: int = 0
+    """Bytes downloaded from the CDN to fill misses"""
+    bytes_served: int = 0
+    """Bytes of chunk data answered from the cache"""
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+
+class ChunkCache:
+    """LRU cache of decoded image chunks, bounded by total size in bytes.
+
+    Keys are `(res_key, (cx, cy, cz))` tuples addressing the dataset's native
+    chunk grid. Values are read-only arrays in [x, y, z, channel] order.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.stats = CacheStats()
+        self._chunks: OrderedDict[tuple, numpy.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._chunks
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def get(self, key) -> numpy.ndarray | None:
+        with self._lock:
+            chunk = self._chunks.get(key)
+            if chunk is None:
+                self.stats.misses += 1
+                return None
+            self._chunks.move_to_end(key)
+            self.stats.hits += 1
+            self.stats.bytes_served += chunk.nbytes
+            return chunk
+
+    def put(self, key, chunk: numpy.ndarray, fetched_bytes: int = 0):
+        chunk.setflags(write=False)
+        with self._lock:
+            self.stats.bytes_fetched += fetched_bytes
+            if chunk.nbytes > self.max_bytes:
+                return
+            old = self._chunks.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._chunks[key] = chunk
+            self.nbytes += chunk.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._chunks.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.stats.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._chunks.clear()
+            self.nbytes = 0
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.stats.hits,
+                "misses": self.stats.misses,
+                "hit_rate": self.stats.hit_rate,
+                "evictions": self.stats.evictions,
+                "bytes_fetched": self.stats.bytes_fetched,
+                "bytes_served": self.stats.bytes_served,
+                "bytes_cached": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "chunks_cached": len(self._chunks),
+            }
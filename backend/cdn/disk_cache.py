@@ -0,0 +1,147 @@
+import os
+import re
+import tempfile
+import threading
+from urllib.parse import urlparse
+
+import numpy
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, eviction is then unsynchronized
+    fcntl = None
+
+DEFAULT_DISK_CACHE_BYTES = 10 * 1024 * 1024 * 1024  # 10 GiB
+EVICTION_TARGET = 0.9
+"""Fraction of the size cap to evict down to, so eviction doesn't run on every write"""
+
+
+def dataset_cache_key(url: str) -> str:
+    """Filesystem-safe directory name identifying a dataset URL"""
+    parsed = urlparse(url)
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", f"{parsed.netloc}{parsed.path}").strip("_")
+
+
+class DiskChunkCache:
+    """Persistent chunk store shared by every backend process on a host.
+
+    Chunks are stored as `.npy` files under
+    `{root}/{dataset}/{res_key}/{cx}_{cy}_{cz}.npy` and read back into memory,
+    so chunks kept by the memory cache hold no open file. Writes go through a
+    temporary file and an atomic rename, so readers in other processes never
+    see a partial chunk. When the store grows past `max_bytes`, the least
+    recently used files (by mtime, refreshed on every hit) are deleted while
+    holding an exclusive lock on `{root}/.lock`.
+    """
+
+    def __init__(self, root: str, dataset: str, max_bytes: int = DEFAULT_DISK_CACHE_BYTES):
+        self.root = root
+        self.path = os.path.join(root, dataset)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+        self._approx_bytes = self._disk_usage()
+
+    def _chunk_path(self, res_key: int, index: tuple[int, int, int]) -> str:
+        return os.path.join(self.path, str(res_key), "{}_{}_{}.npy".format(*index))
+
+    def get(self, res_key: int, index: tuple[int, int, int], record_stats: bool = True) -> numpy.ndarray | None:
+        """Chunk stored on disk, None if there is none
+
+        `record_stats=False` leaves hits and misses untouched, for prefetching.
+        """
+        path = self._chunk_path(res_key, index)
+        try:
+            chunk = numpy.load(path)
+            os.utime(path)
+        except (FileNotFoundError, ValueError, OSError):
+            # missing, evicted by another process, or truncated
+            if record_stats:
+                with self._lock:
+                    self.misses += 1
+            return None
+
+        if record_stats:
+            with self._lock:
+                self.hits += 1
+        return chunk
+
+    def put(self, res_key: int, index: tuple[int, int, int], chunk: numpy.ndarray):
+        path = self._chunk_path(res_key, index)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                numpy.save(f, chunk)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[CDN] Failed to write chunk to disk cache: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            self.bytes_written += chunk.nbytes
+            self._approx_bytes += chunk.nbytes
+            over_budget = self._approx_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def _iter_files(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(".npy"):
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, st
+
+    def _disk_usage(self) -> int:
+        return sum(st.st_size for _, st in self._iter_files())
+
+    def evict(self):
+        """Delete least recently used chunks until the store is under its cap"""
+        with open(os.path.join(self.root, ".lock"), "w") as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return  # another process is already evicting
+
+            files = sorted(self._iter_files(), key=lambda f: f[1].st_mtime)
+            total = sum(st.st_size for _, st in files)
+            target = self.max_bytes * EVICTION_TARGET
+            evicted = 0
+            for path, st in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= st.st_size
+                evicted += 1
+
+        with self._lock:
+            self._approx_bytes = total
+            self.evictions += evicted
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes_written": self.bytes_written,
+                "bytes_on_disk": self._approx_bytes,
+                "max_bytes": self.max_bytes,
+            }
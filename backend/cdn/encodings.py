@@ -0,0 +1,156 @@
+import gzip
+import io
+
+import numpy
+
+try:
+    import zstandard
+except ImportError:  # optional, zstd is simply not offered to the server
+    zstandard = None
+
+try:
+    from PIL import Image
+except ImportError:  # optional, only needed for `jpeg` encoded datasets
+    Image = None
+
+ACCEPT_ENCODING = "zstd, gzip" if zstandard is not None else "gzip"
+"""Transfer encodings offered to the CDN for chunk downloads"""
+
+SUPPORTED_ENCODINGS = ("raw", "jpeg", "compressed_segmentation")
+
+
+def _decompress(data: bytes, content_encoding: str | None) -> bytes:
+    if content_encoding is None or content_encoding in ("", "identity"):
+        return data
+    if content_encoding == "gzip":
+        return gzip.decompress(data)
+    if content_encoding == "zstd":
+        if zstandard is None:
+            raise ValueError("Received zstd content but zstandard is not installed")
+        return zstandard.ZstdDecompressor().stream_reader(data).read()
+    raise ValueError(f"Unsupported content encoding: {content_encoding}")
+
+
+def _decompress_into(data: bytes, content_encoding: str | None, out: numpy.ndarray):
+    """Decompress a transfer encoded body directly into `out`'s memory"""
+    buffer = memoryview(out).cast("B")
+    if content_encoding is None or content_encoding in ("", "identity"):
+        if len(data) != len(buffer):
+            raise ValueError(f"Expected {len(buffer)} bytes, received {len(data)}")
+        buffer[:] = data
+        return
+
+    if content_encoding == "gzip":
+        reader = gzip.GzipFile(fileobj=io.BytesIO(data))
+    elif content_encoding == "zstd":
+        if zstandard is None:
+            raise ValueError("Received zstd content but zstandard is not installed")
+        reader = zstandard.ZstdDecompressor().stream_reader(data)
+    else:
+        raise ValueError(f"Unsupported content encoding: {content_encoding}")
+
+    filled = 0
+    while filled < len(buffer):
+        n = reader.readinto(buffer[filled:])
+        if n == 0:
+            raise ValueError(f"Expected {len(buffer)} bytes, received {filled}")
+        filled += n
+
+
+def decode_raw(data: bytes, content_encoding: str | None, shape: tuple, dtype) -> numpy.ndarray:
+    x, y, z, c = shape
+    if content_encoding is None or content_encoding in ("", "identity"):
+        # nothing to decode, view the response body in place
+        chunk = numpy.frombuffer(data, dtype=numpy.dtype(dtype).newbyteorder("<"))
+    else:
+        chunk = numpy.empty(x * y * z * c, dtype=numpy.dtype(dtype).newbyteorder("<"))
+        _decompress_into(data, content_encoding, chunk)
+    return chunk.reshape((c, z, y, x)).T
+
+
+def decode_jpeg(data: bytes, shape: tuple, dtype) -> numpy.ndarray:
+    """Chunks are a single JPEG of width x and height y * z, one component per channel"""
+    if Image is None:
+        raise ValueError("Dataset uses jpeg encoding but Pillow is not installed")
+    x, y, z, c = shape
+    image = numpy.asarray(Image.open(io.BytesIO(data)), dtype=dtype)
+    return image.reshape((z, y, x, c)).transpose((2, 1, 0, 3))
+
+
+def decode_compressed_segmentation(
+    data: bytes, shape: tuple, dtype, block_size: tuple[int, int, int]
+) -> numpy.ndarray:
+    """Decoder for neuroglancer's compressed_segmentation chunk encoding"""
+    x, y, z, c = shape
+    dtype = numpy.dtype(dtype)
+    words = numpy.frombuffer(data, dtype="<u4")
+    out = numpy.empty((x, y, z, c), dtype=dtype, order="F")
+    value_words = 2 if dtype.itemsize == 8 else 1
+
+    bx, by, bz = block_size
+    grid = [-(-x // bx), -(-y // by), -(-z // bz)]
+    block_voxels = bx * by * bz
+
+    for channel in range(c):
+        base = int(words[channel])
+        block_headers = words[base : base + 2 * grid[0] * grid[1] * grid[2]].reshape(-1, 2)
+        block = 0
+        for gz in range(grid[2]):
+            for gy in range(grid[1]):
+                for gx in range(grid[0]):
+                    header0, header1 = block_headers[block]
+                    block += 1
+                    table_offset = base + int(header0 & 0xFFFFFF)
+                    bits = int(header0 >> 24)
+                    values_offset = base + int(header1)
+
+                    if bits == 0:
+                        indices = numpy.zeros(block_voxels, dtype=numpy.uint32)
+                    else:
+                        per_word = 32 // bits
+                        n_words = -(-block_voxels // per_word)
+                        packed = words[values_offset : values_offset + n_words]
+                        shifts = numpy.arange(per_word, dtype=numpy.uint32) * bits
+                        indices = (packed[:, None] >> shifts) & numpy.uint32((1 << bits) - 1)
+                        indices = indices.reshape(-1)[:block_voxels]
+
+                    table = words[table_offset : table_offset + value_words * (int(indices.max()) + 1)]
+                    table = table.view("<u8") if value_words == 2 else table
+                    values = table[indices].reshape((bz, by, bx)).T
+
+                    x0, y0, z0 = gx * bx, gy * by, gz * bz
+                    x1, y1, z1 = min(x0 + bx, x), min(y0 + by, y), min(z0 + bz, z)
+                    out[x0:x1, y0:y1, z0:z1, channel] = values[: x1 - x0, : y1 - y0, : z1 - z0]
+    return out
+
+
+def decode_chunk(
+    data: bytes,
+    content_encoding: str | None,
+    encoding: str,
+    shape: tuple,
+    dtype,
+    block_size: tuple[int, int, int] | None = None,
+) -> numpy.ndarray:
+    """Decode a downloaded chunk into an [x, y, z, channel] array
+
+    Args:
+        data: response body, still transfer encoded
+        content_encoding: value of the Content-Encoding header
+        encoding: chunk encoding declared by the info scale
+        shape: (x, y, z, channel) shape of the chunk
+        dtype: voxel data type
+        block_size: compressed_segmentation block size
+
+    Returns:
+        numpy.ndarray
+    """
+    if encoding == "raw":
+        return decode_raw(data, content_encoding, shape, dtype)
+
+    data = _decompress(data, content_encoding)
+    if encoding == "jpeg":
+        return decode_jpeg(data, shape, dtype)
+    if encoding == "compressed_segmentation":
+        return decode_compressed_segmentation(data, shape, dtype, block_size or (8, 8, 8))
+    raise ValueError(f"Unsupported chunk encoding: {encoding}")
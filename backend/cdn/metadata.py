@@ -0,0 +1,133 @@
+import json
+import os
+import posixpath
+import tempfile
+import threading
+import time
+
+import requests
+
+from cdn.disk_cache import dataset_cache_key
+from ntracer.utils.timing import print_time
+
+LOGGER_TAG = "CDN"
+DEFAULT_INFO_MAX_AGE = 24 * 60 * 60
+"""Seconds a cached info file is trusted without asking the server"""
+
+_info_cache: dict[str, dict] = {}
+_info_lock = threading.Lock()
+
+
+def validate_info(info: dict) -> dict:
+    """Check that an image info file has everything CdnArray relies on"""
+    try:
+        if info["type"].strip() != "image":
+            raise ValueError("Not an image!")
+        int(info["num_channels"])
+        str(info["data_type"])
+        if len(info["scales"]) == 0:
+            raise ValueError("Metadata has no scales")
+        for scale in info["scales"]:
+            int(scale["key"])
+            if len(scale["resolution"]) != 3 or len(scale["size"]) != 3:
+                raise ValueError(f"Scale {scale['key']} is not 3 dimensional")
+    except (KeyError, TypeError) as e:
+        raise KeyError(f"Failed to parse metadata: {e}")
+    return info
+
+
+def _cache_path(cache_dir: str, url: str) -> str:
+    return os.path.join(cache_dir, f"{dataset_cache_key(url)}.info.json")
+
+
+def _read_cached(path: str) -> dict | None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cached(path: str, entry: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"[{LOGGER_TAG}] Failed to cache metadata: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@print_time(LOGGER_TAG)
+def load_info(
+    url: str, cache_dir: str | None = None, max_age: float = DEFAULT_INFO_MAX_AGE
+) -> dict:
+    """Load and validate the neuroglancer `info` file of a dataset
+
+    The result is kept for the lifetime of the process, so every consumer
+    shares one download. With `cache_dir` set, a copy is also kept on disk:
+    it is used without any request while younger than `max_age` seconds, and
+    revalidated with its ETag/Last-Modified afterwards.
+
+    Args:
+        url: dataset URL, without the trailing `/info`
+        cache_dir: directory for the on-disk copy, None to keep it in memory only
+        max_age: seconds an on-disk copy is used without revalidation
+
+    Returns:
+        dict
+    """
+    with _info_lock:
+        if url in _info_cache:
+            return _info_cache[url]
+
+        info = _load_info(url, cache_dir, max_age)
+        _info_cache[url] = validate_info(info)
+        return info
+
+
+def _load_info(url: str, cache_dir: str | None, max_age: float) -> dict:
+    info_url = posixpath.join(url, "info")
+    path = _cache_path(cache_dir, url) if cache_dir else None
+    cached = _read_cached(path) if path else None
+
+    if cached is not None and time.time() - os.path.getmtime(path) < max_age:
+        return cached["info"]
+
+    headers = {}
+    if cached is not None:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    try:
+        response = requests.get(info_url, headers=headers, timeout=30)
+    except requests.RequestException as e:
+        if cached is not None:
+            print(f"[{LOGGER_TAG}] Using cached metadata, failed to reach {info_url}: {e}")
+            return cached["info"]
+        raise ConnectionError(f"Failed to load metadata from URL: {info_url}")
+
+    if response.status_code == 304 and cached is not None:
+        os.utime(path)
+        return cached["info"]
+    if response.status_code != 200:
+        raise ConnectionError(
+            f"Failed to load metadata from URL: {info_url}: http status code: {response.status_code}"
+        )
+
+    info = response.json()
+    if path is not None:
+        _write_cached(
+            path,
+            {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "info": validate_info(info),
+            },
+        )
+    return info
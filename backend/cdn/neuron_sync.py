@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+from typing import Callable
+
+import httpx
+from ngauge import Neuron
+
+DEFAULT_SYNC_DELAY = 0.2
+"""Seconds changes are collected for before a sync starts, so a burst of undos is sent once"""
+
+LOGGER_TAG = "SYNC"
+
+
+class NeuronSync:
+    """Writes neurons to the skeleton API in the background
+
+    `mark` queues the latest version of some neurons (None for a deleted
+    neuron) and returns at once. A daemon thread collects everything marked
+    within `delay` of the first change and sends it in one pass, through
+    `CdnHelper.sync_neurons`, so neurons changed by several steps of a rapid
+    undo are sent once, in their final state, and only if they differ from
+    the server copy.
+    """
+
+    def __init__(self, cdn_helper, delay: float = DEFAULT_SYNC_DELAY):
+        self.cdn_helper = cdn_helper
+        self.delay = delay
+
+        self.passes = 0
+        self.sent = 0
+        self.skipped = 0
+        self.failed = 0
+
+        self._pending: dict[int, Neuron | None] = {}
+        self._callbacks: list[Callable[[], None]] = []
+        self._busy = False
+        self._stop = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="neuron_sync", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+
+    def mark(self, neurons: dict[int, Neuron | None], on_synced: Callable[[], None] | None = None):
+        """Queue neurons to be written, `on_synced` is called once they are"""
+        with self._cond:
+            self._pending.update(neurons)
+            if on_synced is not None and on_synced not in self._callbacks:
+                self._callbacks.append(on_synced)
+            self._cond.notify_all()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until every queued neuron has been written
+
+        Returns:
+            False if `timeout` expired first
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+    def get_stats(self) -> dict:
+        return {
+            "passes": self.passes,
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "pending": len(self._pending),
+        }
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        client = httpx.AsyncClient()
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stop)
+                if self._stop:
+                    break
+                self._busy = True
+                deadline = time.monotonic() + self.delay
+                while not self._stop:  # let the rest of a burst arrive
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending, {}
+                callbacks, self._callbacks = self._callbacks, []
+
+            try:
+                sent, skipped, failed = loop.run_until_complete(self.cdn_helper.sync_neurons(batch, client))
+                self.sent += sent
+                self.skipped += skipped
+                self.failed += failed
+            except Exception as e:
+                self.failed += len(batch)
+                print(f"[{LOGGER_TAG}] Failed to sync neurons {sorted(batch)}: {e}")
+            self.passes += 1
+
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"[{LOGGER_TAG}] Sync callback failed: {e}")
+
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+        loop.run_until_complete(client.aclose())
+        loop.close()
@@ -0,0 +1,64 @@
+import re
+
+import numpy
+
+try:
+    import msgpack
+except ImportError:  # optional, msgpack is simply not offered to the server
+    msgpack = None
+
+POINTS_BINARY = "application/x-ntracer-points"
+"""Little-endian int32, N x 3 (x, y, z) points"""
+POINTS_MSGPACK = "application/msgpack"
+"""A list of [x, y, z] lists"""
+POINTS_TEXT = "text/plain"
+"""One `x,y,z` line per point (traces) or a single `x,y,z` (mean shift)"""
+
+ACCEPT_POINTS = ", ".join(
+    [POINTS_BINARY] + ([f"{POINTS_MSGPACK};q=0.9"] if msgpack is not None else []) + [f"{POINTS_TEXT};q=0.5"]
+)
+"""Response formats offered to the tracing service, text is the fallback of older servers"""
+
+
+def _media_type(content_type: str | None) -> str:
+    return (content_type or POINTS_TEXT).split(";")[0].strip().lower()
+
+
+def decode_points(data: bytes, content_type: str | None) -> numpy.ndarray:
+    """Decode a points response of the tracing service into an N x 3 int32 array
+
+    Args:
+        data: response body
+        content_type: value of the Content-Type header
+    """
+    media_type = _media_type(content_type)
+    if media_type == POINTS_BINARY:
+        if len(data) % 12 != 0:
+            raise ValueError(f"Binary points response of {len(data)} bytes is not a multiple of 12")
+        return numpy.frombuffer(data, dtype="<i4").reshape(-1, 3)
+    if media_type == POINTS_MSGPACK:
+        if msgpack is None:
+            raise ValueError("Received msgpack content but msgpack is not installed")
+        return numpy.asarray(msgpack.unpackb(data), dtype=numpy.int32).reshape(-1, 3)
+    # anything else is the text format, which older servers send under any
+    # Content-Type (application/json, application/octet-stream) or none
+    text = data.decode().strip()
+    if not text:
+        return numpy.empty((0, 3), dtype=numpy.int32)
+    return numpy.array(re.split(r"[,\s]+", text), dtype=numpy.int32).reshape(-1, 3)
+
+
+def encode_points(points, accept: str | None) -> tuple[bytes, str]:
+    """Encode points in the first format of an Accept header that is supported
+
+    Returns:
+        body, content type
+    """
+    points = numpy.asarray(points, dtype=numpy.int32).reshape(-1, 3)
+    offered = [_media_type(t) for t in (accept or POINTS_TEXT).split(",")]
+    for media_type in offered:
+        if media_type == POINTS_BINARY:
+            return points.astype("<i4").tobytes(), POINTS_BINARY
+        if media_type == POINTS_MSGPACK and msgpack is not None:
+            return msgpack.packb(points.tolist()), POINTS_MSGPACK
+    return "".join(f"{x},{y},{z}\n" for x, y, z in points.tolist()).encode(), POINTS_TEXT
@@ -0,0 +1,104 @@
+import threading
+import time
+from typing import Callable
+
+DEFAULT_PREFETCH_RADIUS = (64, 64, 16)
+DEFAULT_POLL_INTERVAL = 0.5
+DEFAULT_MAX_CHUNKS_PER_SECOND = 20.0
+
+LOGGER_TAG = "PREFETCH"
+
+
+class ChunkPrefetcher:
+    """Warms the chunk cache of one resolution around points of interest.
+
+    A daemon thread polls `target_fn` for the voxel coordinates the user is
+    looking at and downloads every chunk within `radius` of them, nearest
+    first. Downloads are paced to `max_chunks_per_second`, and the current
+    round is abandoned as soon as the targets move to a different chunk, so
+    work for a region the user has left is never finished.
+    """
+
+    def __init__(
+        self,
+        item,
+        target_fn: Callable[[], list[tuple[int, int, int]]],
+        radius: tuple[int, int, int] = DEFAULT_PREFETCH_RADIUS,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        max_chunks_per_second: float = DEFAULT_MAX_CHUNKS_PER_SECOND,
+    ):
+        self.item = item
+        self.target_fn = target_fn
+        self.radius = radius
+        self.poll_interval = poll_interval
+        self.max_chunks_per_second = max_chunks_per_second
+
+        self.chunks_fetched = 0
+        self.rounds_cancelled = 0
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="chunk_prefetcher", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _poll(self) -> tuple[tuple[int, int, int], ...]:
+        """Current targets, reduced to the chunks that contain them"""
+        try:
+            targets = self.target_fn()
+        except Exception as e:
+            print(f"[{LOGGER_TAG}] Failed to read prefetch targets: {e}")
+            return ()
+        return tuple(
+            tuple(int(c) // cs for c, cs in zip(target, self.item.chunk_size))
+            for target in targets
+            if target is not None
+        )
+
+    def _plan(self, target_chunks) -> list[tuple[int, int, int]]:
+        """Chunks within radius of any target, ordered nearest first"""
+        indices = set()
+        for target in target_chunks:
+            bounds = [
+                (max(0, c * cs + cs // 2 - r), min(size, c * cs + cs // 2 + r))
+                for c, cs, r, size in zip(target, self.item.chunk_size, self.radius, self.item._size)
+            ]
+            indices.update(self.item._chunk_indices(bounds))
+
+        def distance(index):
+            return min(
+                sum(abs(a - b) for a, b in zip(index, target)) for target in target_chunks
+            )
+
+        return sorted(indices, key=distance)
+
+    def _run(self):
+        last_targets = ()
+        while not self._stop.is_set():
+            targets = self._poll()
+            if len(targets) == 0 or targets == last_targets:
+                self._stop.wait(self.poll_interval)
+                continue
+
+            last_targets = targets
+            last_poll = time.time()
+            for index in self._plan(targets):
+                if self._stop.is_set():
+                    return
+                if time.time() - last_poll > self.poll_interval:
+                    last_poll = time.time()
+                    if self._poll() != targets:
+                        self.rounds_cancelled += 1
+                        break  # user moved on, start over around the new position
+
+                try:
+                    if self.item.prefetch_chunk(index):
+                        self.chunks_fetched += 1
+                        self._stop.wait(1 / self.max_chunks_per_second)
+                except Exception as e:
+                    print(f"[{LOGGER_TAG}] Failed to prefetch chunk {index}: {e}")
@@ -0,0 +1,161 @@
+"""Local stand-in for the CDN server, serving one in-memory volume.
+
+Answers the requests nTracer2 makes to the CDN: the image `info` file, raw
+chunks, `tracing` and `meanshift`, so tracing can run offline against a
+known volume. Traces use the local engine, mean shift moves to the brightest
+voxel nearby.
+
+Run from the backend directory with a volume saved as [x, y, z] or
+[x, y, z, channel] .npy:
+    python -m cdn.standin_server volume.npy --port 8080 --dataset standin
+"""
+
+import argparse
+import json
+import posixpath
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy
+
+from cdn.point_encoding import encode_points
+
+LOGGER_TAG = "STANDIN"
+CHUNK_PATTERN = re.compile(r"^(\d+)-(\d+)_(\d+)-(\d+)_(\d+)-(\d+)$")
+
+
+class StandinCdnServer:
+    """Serves `volume` as dataset `dataset_id` on localhost
+
+    Usable as a context manager, `url` is the server's base URL once started.
+    """
+
+    def __init__(self, volume: numpy.ndarray, dataset_id: str = "standin", resolution=(1, 1, 1), chunk_size=(64, 64, 64), port: int = 0):
+        self.volume = volume if volume.ndim == 4 else volume[..., None]
+        self.dataset_id = dataset_id
+        self.resolution = list(resolution)
+        self.chunk_size = list(chunk_size)
+        self.requests = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def info(self) -> dict:
+        return {
+            "type": "image",
+            "num_channels": int(self.volume.shape[3]),
+            "data_type": str(self.volume.dtype),
+            "scales": [
+                {
+                    "key": "1",
+                    "resolution": self.resolution,
+                    "size": list(self.volume.shape[:3]),
+                    "chunk_sizes": [self.chunk_size],
+                    "encoding": "raw",
+                }
+            ],
+        }
+
+    def start(self) -> "StandinCdnServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="standin_cdn", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def chunk(self, bounds: list[int]) -> bytes:
+        x1, x2, y1, y2, z1, z2 = bounds
+        return numpy.ascontiguousarray(self.volume[x1:x2, y1:y2, z1:z2].T).tobytes()
+
+    def trace(self, start, end, is_soma: bool) -> list:
+        from algorithm.astar.AstarWrapper import AstarWrapper
+
+        is_multi = self.volume.shape[3] > 1
+        image = self.volume if is_multi else self.volume[..., 0]
+        return AstarWrapper(is_soma=is_soma, is_multi=is_multi).get_trace(start, end, image)
+
+    def mean_shift(self, point, radius=(2, 2, 2)) -> list[int]:
+        lo = [max(0, p - r) for p, r in zip(point, radius)]
+        hi = [min(s, p + r + 1) for p, r, s in zip(point, radius, self.volume.shape)]
+        block = self.volume[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]].sum(axis=3)
+        offset = numpy.unravel_index(numpy.argmax(block), block.shape)
+        return [l + int(o) for l, o in zip(lo, offset)]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server.requests += 1
+                url = urlparse(self.path)
+                parts = [p for p in url.path.split("/") if p]
+                if len(parts) < 2 or parts[0] != server.dataset_id:
+                    return self._send(404, b"Unknown dataset", "text/plain")
+                try:
+                    return self._route(parts[1:], parse_qs(url.query))
+                except (ValueError, IndexError) as e:
+                    return self._send(400, str(e).encode(), "text/plain")
+
+            def _route(self, parts, query):
+                if parts == ["info"]:
+                    return self._send(200, json.dumps(server.info).encode(), "application/json")
+                if len(parts) == 2 and parts[0] == "1" and CHUNK_PATTERN.match(parts[1]):
+                    bounds = [int(b) for b in CHUNK_PATTERN.match(parts[1]).groups()]
+                    return self._send(200, server.chunk(bounds), "application/octet-stream")
+                if len(parts) == 3 and parts[0] == "tracing":
+                    start, end = ([int(c) for c in p.split(",")] for p in parts[1:])
+                    is_soma = query.get("is_soma", ["false"])[0] == "true"
+                    return self._send_points(server.trace(start, end, is_soma))
+                if len(parts) == 2 and parts[0] == "meanshift":
+                    return self._send_points([server.mean_shift([int(c) for c in parts[1].split(",")])])
+                return self._send(404, b"Not found", "text/plain")
+
+            def _send_points(self, points):
+                body, content_type = encode_points(points, self.headers.get("Accept"))
+                self._send(200, body, content_type)
+
+            def _send(self, status, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("volume", help=".npy file, [x, y, z] or [x, y, z, channel]")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--dataset", default="standin")
+    parser.add_argument("--resolution", type=float, nargs=3, default=(1, 1, 1))
+    args = parser.parse_args()
+
+    server = StandinCdnServer(numpy.load(args.volume), args.dataset, args.resolution, port=args.port)
+    print(f"[{LOGGER_TAG}] Serving {args.volume} at {posixpath.join(server.url, args.dataset)}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -26,15 +26,25 @@ class NeuronDict(UserDict[int, Neuron]):
                 stack.append(c)
         return points[id(root)]
 
+    def copy_neuron(self, neuron: Neuron) -> Neuron:
+        """Copy of a neuron that shares no tracing points with it"""
+        new_neuron = Neuron()
+        new_neuron.metadata = neuron.metadata
+        new_neuron.branches = [self.__copy_tp(root) for root in neuron.branches]
+        for points in neuron.soma_layers.values():
+            new_neuron.add_soma_points([(p.x, p.y, p.z, p.z) for p in points])
+        return new_neuron
+
+    def __copy__(self):
+        """Dict sharing the neurons of this one"""
+        result = NeuronDict()
+        result.data = self.data.copy()
+        return result
+
     def __deepcopy__(self, memo):
         result = NeuronDict()
         for key, item in self.items():
-            new_neuron = Neuron()
-            new_neuron.metadata = item.metadata
-            new_neuron.branches = [self.__copy_tp(root) for root in item.branches]
-            for points in item.soma_layers.values():
-                new_neuron.add_soma_points([(p.x, p.y, p.z, p.z) for p in points])
-            result[key] = new_neuron
+            result[key] = self.copy_neuron(item)
 
         memo[id(self)] = result
         return result
@@ -6,7 +6,6 @@ from typing import TYPE_CHECKING, Optional
 from ngauge import Neuron
 from ngauge.TracingPoint import TracingPoint
 
-from algorithm.astar.tracing import get_trace as astar  # pylint: disable=all
 from ntracer.state_injector import inject_state
 
 if TYPE_CHECKING:
@@ -155,15 +154,13 @@ class NeuronHelper:
         else:
             terminal2 = NeuronHelper.move_to_branches(neuron2, indexes2)
 
-        new_path = astar(
-            coords,
+        new_path = state.trace_backend.trace(
             NeuronHelper.physical_to_pixels(
                 (terminal1.x, terminal1.y, terminal1.z), coords.scale
             ),
             NeuronHelper.physical_to_pixels(
                 (terminal2.x, terminal2.y, terminal2.z), coords.scale
             ),
-            state.is_multi,
         )[1:-1]
         new_path = [
             NeuronHelper.pixels_to_physical(xs, coords.scale) for xs in new_path
@@ -43,7 +43,7 @@ def export_swc(state: NtracerState, neuron_ids: list[int]) -> io.BytesIO:
     
     with zipfile.ZipFile(zip_io, "w") as zip_f:
         for neuron_id in neuron_ids:
-            neuron = state.coords.roots[neuron_id]
+            neuron = state.coords.roots.peek(neuron_id)
             out = neuron.to_swc()
             if out is None:
                 print(f"Neuron {neuron_id} cannot be exported to SWC")
@@ -1,6 +1,6 @@
 import sys
 from collections import namedtuple
-from copy import Error, deepcopy
+from copy import Error, copy, deepcopy
 from dataclasses import dataclass, field
 from enum import Enum
 from typing import ItemsView, KeysView
@@ -15,7 +15,11 @@ from ntracer.helpers.neuron_dict import NeuronDict
 from ntracer.helpers.ngauge_helper import NeuronHelper, TracingPointHelper
 from ntracer.helpers.dashboard_state_helper import DashboardState
 
-MAX_HISTORY_SIZE = 50
+DEFAULT_HISTORY_BYTES = 512 * 1024 * 1024  # 512 MiB
+POINT_BYTES = 240
+"""Approximate memory of one TracingPoint"""
+STEP_BYTES = 4096
+"""Approximate memory of a history step besides its neurons"""
 sys.setrecursionlimit(10000)
 
 Action = namedtuple("Action", ["type", "neuron_id"])
@@ -28,20 +32,65 @@ class ActionType(Enum):
     MODIFY_NEURON = 4
 
 
+@dataclass
+class HistoryStep:
+    """One undoable edit, the neurons it changed as they were before and after it
+
+    `before` and `after` map a neuron key to its (neuron, branched) pair,
+    (None, None) where the neuron did not exist. `sizes` maps the id of
+    every neuron on either side to its approximate memory, steps share the
+    neurons they both hold, so the history counts each of them once.
+    """
+
+    dashboard_before: DashboardState
+    dashboard_after: DashboardState | None = None
+    actions: list = field(default_factory=list)
+    before: dict = field(default_factory=dict)
+    after: dict = field(default_factory=dict)
+    sizes: dict = field(default_factory=dict)
+
+
 @dataclass
 class NeuronState:
+    """The neurons being traced
+
+    Neurons are shared with the undo history. A neuron is copied the first
+    time it is looked up with `state[key]` after a new step starts, and its
+    old version is recorded in the step (see `Coords.new_state`), so every
+    change must go through `state[key]`, `state[key] = ...` or `pop`.
+    `peek(key)` and `items()` give the shared neurons, for reading only.
+    """
+
     neuron_dict: NeuronDict = field(default_factory=NeuronDict)
     branched_dict: dict = field(default_factory=dict)
     actions: list = field(default_factory=list)
     dashboard_state: DashboardState = field(default_factory=DashboardState)
+    owned: set = field(default_factory=set)
+    """Keys of the neurons the history does not hold"""
+    step: HistoryStep | None = None
+    """Step recording the changes, None when they are not undoable"""
+
+    def _record(self, key: int):
+        if self.step is not None and key not in self.step.before:
+            self.step.before[key] = (self.neuron_dict.get(key), self.branched_dict.get(key))
 
     def __getitem__(self, key: int) -> Neuron:
+        if key not in self.owned and key in self.neuron_dict:
+            self._record(key)
+            self.neuron_dict[key] = self.neuron_dict.copy_neuron(self.neuron_dict[key])
+            self.owned.add(key)
+        return self.neuron_dict[key]
+
+    def peek(self, key: int) -> Neuron:
+        """Neuron to read without changing it, not copied"""
         return self.neuron_dict[key]
 
     def __setitem__(self, key: int, value: Neuron):
+        self._record(key)
         if not (key in self.neuron_dict):
             self.branched_dict[key] = False
         self.neuron_dict[key] = value
+        self.owned.add(key)
 
     def __iter__(self):
         return self.neuron_dict.__iter__()
@@ -51,6 +100,7 @@ class NeuronState:
 
     def set_branched(self, key: str, value: bool):
         if key in self.neuron_dict:
+            self._record(key)
             self.branched_dict[key] = value
         else:
             raise Exception("Cannot set branch values for undefined neurons")
@@ -65,9 +115,29 @@ class NeuronState:
         return self.neuron_dict.keys()
 
     def pop(self, key: int) -> Neuron:
+        self._record(key)
+        self.owned.discard(key)
         self.branched_dict.pop(key)
         return self.neuron_dict.pop(key)
 
+    def apply(self, delta: dict):
+        """Set the neurons of a `HistoryStep.before` or `after`"""
+        for key, (neuron, branched) in delta.items():
+            if neuron is None:
+                self.neuron_dict.pop(key, None)
+                self.branched_dict.pop(key, None)
+            else:
+                self.neuron_dict[key] = neuron
+                self.branched_dict[key] = branched
+        self.owned.clear()
+
+
+def neuron_bytes(neuron: Neuron | None) -> int:
+    """Approximate memory held by a neuron"""
+    if neuron is None:
+        return 0
+    return POINT_BYTES * sum(1 for _ in neuron.iter_all_points())
+
 
 @dataclass()
 class Coords:
@@ -82,9 +152,15 @@ class Coords:
     timed_out: bool = False
     area: int = 3
     shiftWindow: int = 5
-    roots_history: list[NeuronState] = field(default_factory=lambda: [NeuronState()])
-    roots_pointer: int = 0
+    roots: NeuronState = field(default_factory=NeuronState)
+    history: list[HistoryStep] = field(default_factory=list)
+    history_pointer: int = 0
+    """Number of steps of `history` applied to `roots`"""
+    history_bytes: int = DEFAULT_HISTORY_BYTES
+    """Memory budget of the undo history, the oldest steps are dropped past it"""
     downloaded_neurons: list[int] = field(default_factory=list)
+    placeholders: set[int] = field(default_factory=set)
+    """Neurons listed on the server but not downloaded, held as a one point placeholder"""
     scale: tuple[float, float, float] = 10, 10, 1
 
     @property
@@ -103,49 +179,117 @@ class Coords:
     def dtype(self) -> str:
         return self.im_type
 
-    @property
-    def roots(self) -> NeuronState:
-        return self.roots_history[self.roots_pointer]
-
-    @roots.setter
-    def roots(self, new_roots: NeuronState):
-        if self.roots_pointer >= MAX_HISTORY_SIZE - 1:  # History full, prune
-            self.roots_history.pop(0)
-            self.roots_history.append(new_roots)
-        else:
-            if len(self.roots_history) <= self.roots_pointer + 1:
-                self.roots_history.append(new_roots)
-            else:
-                self.roots_history[self.roots_pointer + 1] = new_roots
-                del self.roots_history[self.roots_pointer + 2 :]
-            self.roots_pointer += 1
-
     def new_state(self):
-        new_coord = NeuronState()
-        new_coord.neuron_dict = deepcopy(self.roots.neuron_dict)
-        new_coord.branched_dict = deepcopy(self.roots.branched_dict)
-        new_coord.dashboard_state = deepcopy(self.roots.dashboard_state)
-        self.roots = new_coord
-
-    def undo(self):
-        if self.roots_pointer == 0:
+        """Start a new undo step
+
+        The changes made to `roots` until the next step are undone together,
+        the step only keeps the neurons they touch, see `NeuronState`.
+        """
+        self._close_step()
+        del self.history[self.history_pointer :]
+        step = HistoryStep(dashboard_before=deepcopy(self.roots.dashboard_state))
+        self.history.append(step)
+        self.history_pointer += 1
+        self.roots.step = step
+        self.roots.owned.clear()
+        self.roots.actions = []
+        self._prune()
+
+    def _close_step(self):
+        step = self.roots.step
+        if step is None:
+            return
+        for key in step.before:
+            step.after[key] = (self.roots.neuron_dict.get(key), self.roots.branched_dict.get(key))
+        step.actions = self.roots.actions
+        step.dashboard_after = deepcopy(self.roots.dashboard_state)
+        for side in (step.before, step.after):
+            for neuron, _ in side.values():
+                if neuron is not None and id(neuron) not in step.sizes:
+                    step.sizes[id(neuron)] = neuron_bytes(neuron)
+        self.roots.step = None
+        self.roots.owned.clear()
+
+    def _prune(self):
+        """Drop the oldest steps until the history fits `history_bytes`"""
+        holders = {}  # neuron id -> number of steps holding it
+        total = 0
+        for step in self.history:
+            total += STEP_BYTES
+            for key, nbytes in step.sizes.items():
+                if key not in holders:
+                    total += nbytes
+                holders[key] = holders.get(key, 0) + 1
+        while total > self.history_bytes and self.history_pointer > 1:
+            step = self.history.pop(0)
+            self.history_pointer -= 1
+            total -= STEP_BYTES
+            for key, nbytes in step.sizes.items():
+                holders[key] -= 1
+                if holders[key] == 0:
+                    total -= nbytes
+
+    def undo(self) -> HistoryStep:
+        """Revert the last step, in time proportional to the neurons it changed"""
+        if self.history_pointer == 0:
             raise Error("No previous state available")
-        self.roots_pointer -= 1
+        self._close_step()
+        self.history_pointer -= 1
+        step = self.history[self.history_pointer]
+        self.roots.apply(step.before)
+        self.roots.dashboard_state = deepcopy(step.dashboard_before)
+        return step
 
     def get_previous_state(self) -> NeuronState:
-        if self.roots_pointer == 0:
+        if self.history_pointer == 0:
             raise Error("No previous state available")
-        return self.roots_history[self.roots_pointer - 1]
+        step = self.history[self.history_pointer - 1]
+        return self._state_with(step.before, step.dashboard_before)
 
-    def redo(self):
-        if self.roots_pointer + 1 > len(self.roots_history) - 1:
+    def redo(self) -> HistoryStep:
+        """Apply the step last undone again"""
+        if self.history_pointer + 1 > len(self.history):
             raise Error("No next state available")
-        self.roots_pointer += 1
+        step = self.history[self.history_pointer]
+        self.history_pointer += 1
+        self.roots.apply(step.after)
+        self.roots.dashboard_state = deepcopy(step.dashboard_after)
+        return step
 
     def get_next_state(self) -> NeuronState:
-        if self.roots_pointer + 1 > len(self.roots_history) - 1:
+        if self.history_pointer + 1 > len(self.history):
             raise Error("No next state available")
-        return self.roots_history[self.roots_pointer + 1]
+        step = self.history[self.history_pointer]
+        return self._state_with(step.after, step.dashboard_after)
+
+    def _state_with(self, delta: dict, dashboard_state: DashboardState) -> NeuronState:
+        state = NeuronState(
+            neuron_dict=copy(self.roots.neuron_dict),
+            branched_dict=self.roots.branched_dict.copy(),
+            dashboard_state=deepcopy(dashboard_state),
+        )
+        state.apply(delta)
+        return state
+
+    def load_neuron(self, key: int, neuron: Neuron):
+        """Set a neuron as read from the server, outside of the undo history
+
+        Versions of a placeholder the history holds are replaced there as
+        well, so undo never brings one back.
+        """
+        if key in self.placeholders:
+            nbytes = neuron_bytes(neuron)
+            for step in self.history:
+                for side in (step.before, step.after):
+                    old, branched = side.get(key, (None, None))
+                    if old is not None:
+                        side[key] = (neuron, branched)
+                        step.sizes.pop(id(old), None)
+                        step.sizes[id(neuron)] = nbytes
+        self.placeholders.discard(key)
+        self.roots.neuron_dict[key] = neuron
+        self.roots.branched_dict.setdefault(key, False)
+        self.roots.owned.discard(key)  # copied and recorded by the next edit
 
     def remove_root(self, neuron_index: int):
         """Remove a neuron from roots"""
@@ -224,6 +368,6 @@ class Coords:
         return min_pos, id
 
     def get_pt(self, pos: tuple[int, int, int], neuron_id: int):
-        for pt in self.roots[neuron_id].iter_all_points(False):
+        for pt in self.roots.peek(neuron_id).iter_all_points(False):
             if pos[0] == pt.x and pos[1] == pt.y and pos[2] == pt.z:
                 return pt
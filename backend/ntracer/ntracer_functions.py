@@ -45,11 +45,7 @@ class NtracerFunctions:
         point = tuple(map(int, coordinates))
         if no_mean_shift is False:
             print("Running mean shift")
-            x = mean_shift(
-                point,
-                state.cdn_url.geturl(),
-                state.dataset_id,
-            )
+            x = mean_shift(point)
             new_point = x
         else:
             new_point = point
@@ -184,12 +180,13 @@ class NtracerFunctions:
         NUM_PREFETCH = 5
 
         res = coords.cdn_helper.get_all_neurons()
-        coords.new_state()
-        coords.roots.actions.append(Action(ActionType.DATABASE_RETRIEVE, -1))
 
+        # not undoable, undo would delete every neuron on the server
         for neuron_id, _ in res[:-NUM_PREFETCH]:
-            coords.roots[neuron_id] = Neuron()
-            coords.roots[neuron_id].add_branch(TP(0, 0, 0, 0, 0))
+            placeholder = Neuron()
+            placeholder.add_branch(TP(0, 0, 0, 0, 0))
+            coords.load_neuron(neuron_id, placeholder)
+            coords.placeholders.add(neuron_id)
 
         prefetched_neurons = await asyncio.gather(*[coords.cdn_helper.get_swc(neuron_id, True) for neuron_id, _ in res[-NUM_PREFETCH:]])
         for i, (neuron_id, _) in enumerate(res[-NUM_PREFETCH:]):
@@ -197,7 +194,8 @@ class NtracerFunctions:
             if not isinstance(neuron, Neuron):
                 raise Warning("Cannot load neuron from swc")
             else:
-                coords.roots[neuron_id] = neuron
+                coords.load_neuron(neuron_id, neuron)
+                coords.downloaded_neurons.append(neuron_id)
 
 
     @staticmethod
@@ -233,7 +231,7 @@ class NtracerFunctions:
 
         if dashboard_state.is_neuron_selected:
             neuron_id = dashboard_state.selected_neuron_id
-            neuron = coords.roots[neuron_id]
+            neuron = coords.roots.peek(neuron_id)
 
             if dashboard_state.is_soma_selected:
                 return NeuronHelper.get_simple_neuron_soma(
@@ -255,7 +253,7 @@ class NtracerFunctions:
             neuron_id = dashboard_state.selected_neuron_id
             return [
                 {"neuron": neuron_id + 1, "z_slice": z_slice}
-                for z_slice, _ in state.coords.roots[neuron_id].soma_layers.items()
+                for z_slice, _ in state.coords.roots.peek(neuron_id).soma_layers.items()
             ]
         return []
     
@@ -292,7 +290,7 @@ class NtracerFunctions:
 
         if selected_neuron_index is not None:
             current_coords = (pt.x, pt.y, pt.z)
-            neuron = coords.roots[selected_neuron_index]
+            neuron = coords.roots.peek(selected_neuron_index)
             branch_indexes = NeuronHelper.get_branch_indexes_from_point(
                 neuron, current_coords
             )
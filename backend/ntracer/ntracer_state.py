@@ -3,15 +3,28 @@ import posixpath
 from dataclasses import dataclass
 from urllib.parse import urlparse
 
-import requests
 from neuroglancer import Viewer
 from neuroglancer.viewer_config_state import ActionState
 
-from cdn.cdn_array import CdnArray
+from algorithm.astar.AstarWrapper import CancelToken
+from algorithm.astar.cost_volume import CostVolumeCache, DEFAULT_COST_CACHE_BYTES
+from algorithm.astar.trace_backend import (
+    LocalTraceBackend,
+    RemoteTraceBackend,
+    TraceBackend,
+    make_trace_backend,
+)
+from algorithm.astar.tracing import DEFAULT_TRACE_WORKERS, set_trace_workers
+from cdn.cdn_array import CdnArray, DEFAULT_FETCH_WORKERS
+from cdn.chunk_cache import DEFAULT_CACHE_BYTES
+from cdn.disk_cache import DEFAULT_DISK_CACHE_BYTES
+from cdn.metadata import DEFAULT_INFO_MAX_AGE, load_info
+from cdn.prefetcher import ChunkPrefetcher, DEFAULT_MAX_CHUNKS_PER_SECOND, DEFAULT_PREFETCH_RADIUS
 from cdn.cdn_helper import CdnHelper
 from ntracer.helpers.dashboard_state_helper import DashboardState
 from ntracer.helpers.freehand_state_helper import FreehandState
-from ntracer.helpers.tracing_data_helper import Coords
+from ntracer.helpers.tracing_data_helper import Coords, DEFAULT_HISTORY_BYTES
+from ntracer.tracing.mean_shift import DEFAULT_MEMO_ENTRIES, MEAN_SHIFT_MODES, MeanShiftMemo
 from ntracer.utils.timing import print_time
 
 
@@ -51,6 +64,80 @@ class NtracerState:
 
     file_server_port: int = 8082
 
+    cdn_cache_bytes: int = int(os.environ.get("CDN_CACHE_BYTES", DEFAULT_CACHE_BYTES))
+    """Memory budget for image chunks cached by the CdnArray"""
+
+    cdn_fetch_workers: int = int(os.environ.get("CDN_FETCH_WORKERS", DEFAULT_FETCH_WORKERS))
+    """Number of chunks downloaded concurrently for one slice"""
+
+    cdn_disk_cache_dir: str | None = os.environ.get("CDN_DISK_CACHE_DIR")
+    """Directory for the persistent chunk cache, disabled if unset"""
+
+    cdn_disk_cache_bytes: int = int(os.environ.get("CDN_DISK_CACHE_BYTES", DEFAULT_DISK_CACHE_BYTES))
+
+    cdn_metadata_cache_dir: str | None = os.environ.get(
+        "CDN_METADATA_CACHE_DIR", os.environ.get("CDN_DISK_CACHE_DIR")
+    )
+    """Directory for the cached image info file, kept in memory only if unset"""
+
+    cdn_metadata_max_age: float = float(os.environ.get("CDN_METADATA_MAX_AGE", DEFAULT_INFO_MAX_AGE))
+    """Seconds a cached info file is used before revalidating it with the CDN"""
+
+    prefetch_enabled: bool = os.environ.get("PREFETCH", "true").lower() == "true"
+    """Warm the chunk cache around the viewer position and selected point"""
+
+    prefetch_radius: tuple[int, int, int] = (
+        int(os.environ.get("PREFETCH_XY", DEFAULT_PREFETCH_RADIUS[0])),
+        int(os.environ.get("PREFETCH_XY", DEFAULT_PREFETCH_RADIUS[1])),
+        int(os.environ.get("PREFETCH_Z", DEFAULT_PREFETCH_RADIUS[2])),
+    )
+    """Neighbourhood, in voxels of the tracing resolution, warmed around each target"""
+
+    prefetch_max_chunks_per_second: float = float(
+        os.environ.get("PREFETCH_MAX_CHUNKS_PER_SECOND", DEFAULT_MAX_CHUNKS_PER_SECOND)
+    )
+
+    prefetcher: ChunkPrefetcher | None = None
+
+    trace_workers: int = int(os.environ.get("TRACE_WORKERS", DEFAULT_TRACE_WORKERS))
+    """Number of traces run in parallel by `trace_async`"""
+
+    trace_max_nodes: int = int(os.environ.get("TRACE_MAX_NODES", 0))
+    """Voxels a single trace may expand before it is stopped, 0 for no limit"""
+
+    trace_max_seconds: float = float(os.environ.get("TRACE_MAX_SECONDS", 15))
+    """Wall time a single trace may take before it is stopped, 0 for no limit"""
+
+    trace_partial: bool = os.environ.get("TRACE_PARTIAL", "false").lower() == "true"
+    """Keep the path found toward the end point when a trace is stopped"""
+
+    trace_coarse_to_fine: bool = os.environ.get("TRACE_COARSE_TO_FINE", "false").lower() == "true"
+    """Trace long paths on a downsampled level first, then refine along them"""
+
+    trace_cancels: set[CancelToken] | None = None
+    """Tokens of the traces in progress, all cancelled by /trace/cancel"""
+
+    cost_cache_bytes: int = int(os.environ.get("COST_CACHE_BYTES", DEFAULT_COST_CACHE_BYTES))
+    """Memory budget for A* cost volumes reused by consecutive traces"""
+
+    cost_cache: CostVolumeCache | None = None
+
+    trace_backend_mode: str = os.environ.get("TRACE_BACKEND", "remote").lower()
+    """Where traces run: local, remote or auto (local, remote if that fails)"""
+
+    trace_backend: TraceBackend | None = None
+
+    mean_shift_mode: str = os.environ.get("MEAN_SHIFT", "remote").lower()
+    """Where points are snapped to the signal: local, remote or auto (local, remote if that fails)"""
+
+    mean_shift_memo_entries: int = int(os.environ.get("MEAN_SHIFT_MEMO_ENTRIES", DEFAULT_MEMO_ENTRIES))
+    """Mean shift results remembered, so re-clicking a voxel is instant"""
+
+    undo_history_bytes: int = int(os.environ.get("UNDO_HISTORY_BYTES", DEFAULT_HISTORY_BYTES))
+    """Memory budget of the undo history"""
+
+    mean_shift_memo: MeanShiftMemo | None = None
+
     is_multi: bool = False  # set on image load
     """True if image has more than 3 channels"""
 
@@ -63,14 +150,30 @@ class NtracerState:
 
     @print_time("NTRACER_STATE")
     def __init__(self):
-        # Check if image is multi-channel
-        self.is_multi = self.__is_multi()
+        # Load image metadata once, shared with the CdnArray
+        self.metadata = load_info(
+            self.cdn_url_dataset.geturl(),
+            cache_dir=self.cdn_metadata_cache_dir,
+            max_age=self.cdn_metadata_max_age,
+        )
+        # 211124 Changing to call any multichannel image "multi"
+        self.is_multi = int(self.metadata["num_channels"]) > 1
+
+        set_trace_workers(self.trace_workers)
+        self.trace_cancels = set()
+        self.cost_cache = CostVolumeCache(self.cost_cache_bytes)
+        self.mean_shift_memo = MeanShiftMemo(self.mean_shift_memo_entries)
 
         # Load Image
         cdn_helper = CdnHelper(self.database_url)
         cdn_array = CdnArray(
             drop_channel_dim=False if self.is_multi else True,
             url=self.cdn_url_dataset.geturl(),
+            cache_bytes=self.cdn_cache_bytes,
+            max_workers=self.cdn_fetch_workers,
+            disk_cache_dir=self.cdn_disk_cache_dir,
+            disk_cache_bytes=self.cdn_disk_cache_bytes,
+            metadata=self.metadata,
         )
         scale = cdn_array.scales[0]["resolution"]
         layer_data = [cdn_array[i] for i in cdn_array.keys()]
@@ -79,24 +182,32 @@ class NtracerState:
             cdn_helper=cdn_helper,
             scale=scale,
             layer_data=layer_data,
+            history_bytes=self.undo_history_bytes,
+        )
+
+        self.trace_backend = make_trace_backend(
+            self.trace_backend_mode,
+            local=LocalTraceBackend(
+                self.coords,
+                self.is_multi,
+                max_nodes=self.trace_max_nodes,
+                max_seconds=self.trace_max_seconds,
+                partial=self.trace_partial,
+                cost_cache=self.cost_cache,
+                coarse_to_fine=self.trace_coarse_to_fine,
+            ),
+            remote=RemoteTraceBackend(
+                self.cdn_url.geturl(),
+                self.dataset_id,
+                self.is_multi,
+                max_seconds=self.trace_max_seconds,
+            ),
         )
 
+        if self.mean_shift_mode not in MEAN_SHIFT_MODES:
+            raise ValueError(f"Unknown mean shift mode: {self.mean_shift_mode}, expected one of {', '.join(MEAN_SHIFT_MODES)}")
+
         self.dashboard_state.scale = scale
         self.image: CdnArray.CdnResolutionItem = self.coords.layer_data[
             0
         ]  # highest resolution
-
-    def __is_multi(self) -> bool:
-        url = posixpath.join(
-            self.cdn_url_dataset.geturl(),
-            "info",
-        )
-        try:
-            # 211124 Changing to call any multichannel image "multi"
-            return requests.get(url).json()["num_channels"] > 1
-        except Exception as e:
-            print(
-                "Error, checking if image is multi-channel, verify Neuroglancer info file for image exists at:",
-                url,
-            )
-            raise e
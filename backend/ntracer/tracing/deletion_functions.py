@@ -84,15 +84,15 @@ class DeletionFunctions:
                 neuron_id, state.dashboard_state.selected_soma_z_slice, selected_point
             )
             if (
-                len(coords.roots[neuron_id].soma_layers) == 0
-                and len(coords.roots[neuron_id].branches) == 0
+                len(coords.roots.peek(neuron_id).soma_layers) == 0
+                and len(coords.roots.peek(neuron_id).branches) == 0
             ):
                 DeletionFunctions.delete_neuron(neuron_id)
             else:
                 UpdateFunctions.replace_neuron(state.coords, neuron_id)
         else:
             branch = NeuronHelper.get_child_branch(
-                coords.roots[neuron_id], branch_indexes[0]
+                coords.roots.peek(neuron_id), branch_indexes[0]
             )
             branch = TracingPointHelper.move_to_branches(branch, branch_indexes[1:])
             if branch.total_child_nodes() == 1:
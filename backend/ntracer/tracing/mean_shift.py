@@ -1,12 +1,212 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+import numpy as np
 import requests
+from cdn.chunk_cache import CacheStats
+from cdn.point_encoding import ACCEPT_POINTS, decode_points
+from ntracer.state_injector import inject_state
 from ntracer.utils.timing import print_time
 
-@print_time("TRACING")
-def mean_shift(
+if TYPE_CHECKING:
+    from ntracer.ntracer_state import NtracerState
+
+LOGGER_TAG = "TRACING"
+MEAN_SHIFT_MODES = ("local", "remote", "auto")
+"""`auto` shifts locally and asks the remote service if that fails"""
+MAX_ITERATIONS = 5
+REGION_TILE = 256
+"""Points are snapped in groups that share one region read per tile of this many voxels"""
+DEFAULT_MEMO_ENTRIES = 4096
+
+
+class MeanShiftMemo:
+    """LRU of mean shift results, so re-clicking a voxel does not shift it again
+
+    Keys hold the rounded voxel and everything the result depends on
+    (dataset, radii, analysis channels), see `mean_shift_points`.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MEMO_ENTRIES):
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        self._results: OrderedDict[tuple, tuple[int, int, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def get(self, key) -> tuple[int, int, int] | None:
+        with self._lock:
+            point = self._results.get(key)
+            if point is None:
+                self.stats.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.stats.hits += 1
+            return point
+
+    def put(self, key, point: tuple[int, int, int]):
+        with self._lock:
+            self._results[key] = point
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+                self.stats.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            "hits": self.stats.hits,
+            "misses": self.stats.misses,
+            "hit_rate": self.stats.hit_rate,
+            "evictions": self.stats.evictions,
+            "entries": len(self._results),
+            "max_entries": self.max_entries,
+        }
+
+
+def _kernel(radius: tuple[int, int, int]) -> np.ndarray:
+    """Offsets of the voxels inside an ellipsoid of `radius`, K x 3"""
+    grid = np.stack(
+        np.meshgrid(*[np.arange(-r, r + 1) for r in radius], indexing="ij"), axis=-1
+    ).reshape(-1, 3)
+    scaled = grid / np.maximum(np.array(radius, dtype=np.float32), 1)
+    return grid[(scaled**2).sum(axis=1) <= 1]
+
+
+def _shift(region: np.ndarray, centers: np.ndarray, radius, iterations: int, is_multi: bool) -> np.ndarray:
+    """Mean shift every center (N x 3, region coordinates) over `region` at once"""
+    offsets = _kernel(radius)
+    shape = np.array(region.shape[:3])
+    centers = centers.astype(np.float32)
+    seeds = np.clip(np.rint(centers).astype(int), 0, shape - 1)
+    if is_multi:
+        # weight each voxel by how close its colour is to the colour clicked on
+        seed_colors = region[seeds[:, 0], seeds[:, 1], seeds[:, 2]].astype(np.float32)
+        seed_colors /= np.maximum(np.linalg.norm(seed_colors, axis=1, keepdims=True), 1e-6)
+
+    active = np.ones(len(centers), dtype=bool)
+    for _ in range(iterations):
+        if not active.any():
+            break
+        voxels = np.rint(centers[active]).astype(int)[:, None, :] + offsets[None]  # N x K x 3
+        inside = ((voxels >= 0) & (voxels < shape)).all(axis=2)
+        voxels = np.clip(voxels, 0, shape - 1)
+        values = region[voxels[..., 0], voxels[..., 1], voxels[..., 2]].astype(np.float32)
+
+        if is_multi:
+            brightness = values.sum(axis=2)
+            colors = values / np.maximum(np.linalg.norm(values, axis=2, keepdims=True), 1e-6)
+            similarity = np.clip((colors * seed_colors[active][:, None, :]).sum(axis=2), 0, 1)
+            weights = brightness * similarity**2
+        else:
+            weights = values
+        # drop the local background so dim voxels do not pull toward the window center
+        weights = np.where(inside, weights, np.inf)
+        weights = np.where(inside, weights - weights.min(axis=1, keepdims=True), 0)
+
+        total = weights.sum(axis=1)
+        moved = np.where(
+            (total > 0)[:, None],
+            (weights[..., None] * voxels).sum(axis=1) / np.maximum(total, 1e-6)[:, None],
+            centers[active],
+        )
+        converged = np.abs(moved - centers[active]).max(axis=1) < 0.5
+        centers[active] = moved
+        active[np.flatnonzero(active)[converged]] = False
+
+    return np.clip(np.rint(centers).astype(int), 0, shape - 1)
+
+
+def mean_shift_batch(image, points, radius: tuple[int, int, int], is_multi: bool, iterations: int = MAX_ITERATIONS, channels: list[int] | None = None) -> np.ndarray:
+    """Move every point to the center of the signal around it
+
+    Points close together are shifted together over a single read of the
+    region around them, so snapping a whole stroke or skeleton costs one read
+    per region instead of one request per point.
+
+    Args:
+        image: [x, y, z] (or [x, y, z, channel] if `is_multi`) array or CdnArray resolution
+        points: N x 3 voxel coordinates
+        radius: half-size of the window in x, y and z voxels
+        iterations: maximum number of shifts of a point
+        channels: channels of a multichannel image to shift on, all if None
+
+    Returns:
+        N x 3 int array
+    """
+    points = np.rint(np.asarray(points, dtype=np.float64).reshape(-1, 3)).astype(int)
+    result = np.empty_like(points)
+    margin = np.array(radius) * (iterations + 1)
+    tiles = points // REGION_TILE
+    for tile in np.unique(tiles, axis=0):
+        group = (tiles == tile).all(axis=1)
+        lo = np.maximum(points[group].min(axis=0) - margin, 0)
+        hi = np.minimum(points[group].max(axis=0) + margin + 1, image.shape[:3])
+        region = np.asarray(image[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]])
+        if is_multi and channels:
+            region = region[..., channels]
+        result[group] = _shift(region, points[group] - lo, radius, iterations, is_multi) + lo
+    return result
+
+
+@print_time(LOGGER_TAG)
+def mean_shift_remote(
     pt: tuple[float, float, float], server_url: str, dataset_id: str
 ) -> tuple[int, int, int]:
     start = [round(c) for c in pt]
     res = requests.get(
-        f"{server_url}/{dataset_id}/meanshift/{start[0]},{start[1]},{start[2]}"
+        f"{server_url}/{dataset_id}/meanshift/{start[0]},{start[1]},{start[2]}",
+        headers={"Accept": ACCEPT_POINTS},
     )
-    return tuple((int(x) for x in res.text.split(",")))
+    return tuple(decode_points(res.content, res.headers.get("Content-Type"))[0].tolist())
+
+
+@inject_state
+def mean_shift_points(state: NtracerState, points) -> list[tuple[int, int, int]]:
+    """Snap points to the signal with the dashboard's mean shift radii
+
+    Runs locally on the cached image data, or on the remote service as
+    configured by MEAN_SHIFT. Results are memoized in `state.mean_shift_memo`.
+    """
+    radius = (
+        state.dashboard_state.mean_shift_XY,
+        state.dashboard_state.mean_shift_XY,
+        state.dashboard_state.mean_shift_Z,
+    )
+    channels = tuple(state.dashboard_state.selected_analysis_channels) if state.is_multi else ()
+    keys = [(state.dataset_id, tuple(round(c) for c in p), radius, channels) for p in points]
+    results = [state.mean_shift_memo.get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if not missing:
+        return results
+
+    shifted = _mean_shift_points(state, [keys[i][1] for i in missing], radius, list(channels))
+    for i, point in zip(missing, shifted):
+        state.mean_shift_memo.put(keys[i], point)
+        results[i] = point
+    return results
+
+
+def _mean_shift_points(state: NtracerState, points, radius, channels) -> list[tuple[int, int, int]]:
+    if state.mean_shift_mode != "remote":
+        try:
+            shifted = mean_shift_batch(state.image, points, radius, state.is_multi, channels=channels)
+            return [tuple(p) for p in shifted.tolist()]
+        except Exception as e:
+            if state.mean_shift_mode == "local":
+                raise
+            print(f"[{LOGGER_TAG}] local mean shift failed, using remote: {e}")
+    return [mean_shift_remote(p, state.cdn_url.geturl(), state.dataset_id) for p in points]
+
+
+@print_time(LOGGER_TAG)
+def mean_shift(pt: tuple[float, float, float]) -> tuple[int, int, int]:
+    return mean_shift_points([pt])[0]
@@ -9,7 +9,7 @@ from flask_socketio import SocketIO
 from ngauge import Neuron
 from ngauge import TracingPoint as TP
 
-from algorithm.astar.tracing import get_trace_cdn as astar
+from algorithm.astar.AstarWrapper import CancelToken
 from ntracer.helpers.ngauge_helper import NeuronHelper, TracingPointHelper
 from ntracer.helpers.tracing_data_helper import Action, ActionType
 from ntracer.ntracer_functions import NtracerFunctions
@@ -43,6 +43,15 @@ class TracingFunctions:
 
         return TracingFunctions._connect_points(start, end, is_soma)
     
+    @staticmethod
+    @inject_state
+    def cancel_trace(state: NtracerState) -> bool:
+        """Stop every trace in progress, False if there is none"""
+        cancels = list(state.trace_cancels)
+        for cancel in cancels:
+            cancel.cancel()
+        return len(cancels) > 0
+
     @staticmethod
     @inject_state
     def complete_soma(state: NtracerState, neuron_id: int, selected_soma_z_slice: int):
@@ -71,19 +80,21 @@ class TracingFunctions:
             state.dashboard_state.selected_soma_z_slice = -1
         
         print("Running Astar:", start, end)
+        cancel = CancelToken()
+        state.trace_cancels.add(cancel)
         try:
-            new_path = astar(
-                state.cdn_url.geturl(),
-                state.dataset_id,
+            new_path = state.trace_backend.trace(
                 start,
                 end,
-                state.is_multi,
                 is_soma,
                 tracing_sensitivity=state.dashboard_state.tracing_sensitivity,
+                cancel=cancel,
             )
         except Exception as e:
             IndicatorFunctions.add_status_message(f"Trace failed: {e}", "connect")
             return
+        finally:
+            state.trace_cancels.discard(cancel)
         
         # Path drawn, need to connect path to each other AND root to existing node
         s: ViewerState
@@ -113,7 +124,7 @@ class TracingFunctions:
         
         if state.dashboard_state.is_neuron_selected:
             neuron_id = state.dashboard_state.selected_neuron_id
-            neuron = state.coords.roots[neuron_id]
+            neuron = state.coords.roots.peek(neuron_id)
             branch_indexes = NeuronHelper.get_branch_indexes_from_point(
                 neuron, new_path[-1]
             )
@@ -272,7 +283,7 @@ class TracingFunctions:
 
         if state.dashboard_state.is_neuron_selected:
             neuron_id = state.dashboard_state.selected_neuron_id
-            neuron = state.coords.roots[neuron_id]
+            neuron = state.coords.roots.peek(neuron_id)
             branch_indexes = NeuronHelper.get_branch_indexes_from_point(
                 neuron, state.freehand_state.traversed_points_physical[-1]
             )
@@ -21,12 +21,12 @@ class UpdateFunctions:
     @staticmethod
     def update_neuron(coords: Coords, neuron_id: int, count: int) -> None:
         """Update specific neuron in database"""
-        neuron = coords.roots[neuron_id]
+        neuron = coords.roots.peek(neuron_id)
         coords.cdn_helper.update_neuron(neuron_id, neuron)
 
     @staticmethod
     def replace_neuron(coords: Coords, neuron_id: int) -> None:
-        neuron = coords.roots[neuron_id]
+        neuron = coords.roots.peek(neuron_id)
         coords.cdn_helper.replace_neuron(neuron_id, neuron)
 
     @staticmethod
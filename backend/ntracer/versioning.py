@@ -1,6 +1,6 @@
 from flask_socketio import SocketIO
 
-from ntracer.helpers.tracing_data_helper import ActionType
+from ntracer.helpers.tracing_data_helper import Coords, HistoryStep
 from ntracer.ntracer_functions import NtracerFunctions
 from ntracer.ntracer_state import NtracerState
 from ntracer.state_injector import inject_state, inject_state_and_socketio
@@ -15,28 +15,17 @@ class Versioning:
         coords = state.coords
         if hasattr(state.coords, 'roots'):
             state.coords.roots.dashboard_state.set_state_dict(state.dashboard_state)
-        coords.undo()
+        step = coords.undo()
 
-        for action in coords.roots.actions:
-            print(action)
-            if action.type == ActionType.ADD_NEURON:
-                coords.cdn_helper.delete_neuron(action.neuron_id)
-            elif action.type == ActionType.DELETE_NEURON:
-                neuron_swc = coords.roots[action.neuron_id].to_swc()
-                if neuron_swc is None:
-                    raise Warning("Cannot load swc from neuron")
-                
-                neuron_swc = [line.strip().split() for line in neuron_swc.splitlines()]
-                coords.cdn_helper.add_neuron(neuron_swc, action.neuron_id)
-            elif action.type == ActionType.MODIFY_NEURON:
-                coords.cdn_helper.replace_neuron(
-                    action.neuron_id, coords.roots[action.neuron_id]
-                )
+        # written in the background, the skeleton layer reloads once they are
+        coords.cdn_helper.sync.mark(
+            Versioning._changed_neurons(coords, step, step.before),
+            on_synced=NtracerFunctions.request_fileserver_update,
+        )
 
         IndicatorFunctions.clear_points()
         state.dashboard_state.set_state_dict(coords.roots.dashboard_state)
         NtracerFunctions.set_selected_points()
-        NtracerFunctions.request_fileserver_update()
         ImageFunctions.image_write()
 
         NtracerFunctions.change_coordinate_on_select(state.dashboard_state.selected_point, state.coords.scale)
@@ -45,28 +34,33 @@ class Versioning:
     @inject_state
     def redo(state: NtracerState):
         coords = state.coords
-        coords.redo()
+        step = coords.redo()
 
-        # Redo database changes
-        for action in coords.roots.actions:
-            if action.type == ActionType.ADD_NEURON:
-                neuron_swc = coords.roots[action.neuron_id].to_swc()
-                if neuron_swc is None:
-                    raise Warning("Cannot load swc from neuron")
-
-                neuron_swc = [line.strip().split() for line in neuron_swc.splitlines()]
-                coords.cdn_helper.add_neuron(neuron_swc, action.neuron_id)
-            elif action.type == ActionType.DELETE_NEURON:
-                coords.cdn_helper.delete_neuron(action.neuron_id)
-            elif action.type == ActionType.MODIFY_NEURON:
-                coords.cdn_helper.replace_neuron(
-                    action.neuron_id, coords.roots[action.neuron_id]
-                )
+        coords.cdn_helper.sync.mark(
+            Versioning._changed_neurons(coords, step, step.after),
+            on_synced=NtracerFunctions.request_fileserver_update,
+        )
 
         IndicatorFunctions.clear_points()
         state.dashboard_state.set_state_dict(coords.roots.dashboard_state)
         NtracerFunctions.set_selected_points()
-        NtracerFunctions.request_fileserver_update()
         ImageFunctions.image_write()
 
-        NtracerFunctions.change_coordinate_on_select(state.dashboard_state.selected_point, state.coords.scale)
\ No newline at end of file
+        NtracerFunctions.change_coordinate_on_select(state.dashboard_state.selected_point, state.coords.scale)
+
+    @staticmethod
+    def _changed_neurons(coords: Coords, step: HistoryStep, delta: dict) -> dict:
+        """Neurons of `delta` named by the actions of `step`, as they are to be written
+
+        Placeholders of neurons never downloaded are left out, the server
+        holds the real neuron.
+        """
+        neurons = {}
+        for action in step.actions:
+            if action.neuron_id not in delta:
+                continue
+            neuron, _ = delta[action.neuron_id]
+            if neuron is not None and action.neuron_id in coords.placeholders:
+                continue
+            neurons[action.neuron_id] = neuron
+        return neurons
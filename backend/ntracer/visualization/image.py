@@ -8,6 +8,7 @@ import neuroglancer.webdriver
 from ngauge import TracingPoint as TP
 
 from neuroglancer.viewer_state import ViewerState
+from cdn.prefetcher import ChunkPrefetcher
 from ntracer.constants import Constants
 from ntracer.helpers.ngauge_helper import NeuronHelper
 from ntracer.ntracer_state import NtracerState
@@ -86,6 +87,33 @@ class ImageFunctions:
             dashboard_state.min_projection_slice = min(1, z_slices)
             dashboard_state.max_projection_slice = z_slices // 4
 
+        if state.prefetch_enabled and state.prefetcher is None:
+            state.prefetcher = ChunkPrefetcher(
+                coords.layer_data[0],
+                ImageFunctions.get_prefetch_targets,
+                radius=state.prefetch_radius,
+                max_chunks_per_second=state.prefetch_max_chunks_per_second,
+            )
+            state.prefetcher.start()
+
+    @staticmethod
+    @inject_state
+    def get_prefetch_targets(state: NtracerState) -> list[tuple[int, int, int]]:
+        """Voxel coordinates the user is likely to trace from next"""
+        targets = []
+        if state.viewer is not None:
+            position = state.viewer.state.position
+            if position is not None and len(position) >= 3:
+                targets.append(tuple(map(int, position[:3])))
+        selected_point = state.dashboard_state.selected_point
+        if selected_point is not None and tuple(selected_point) != (-1, -1, -1):  # (-1, -1, -1) is unset
+            targets.append(
+                NeuronHelper.physical_to_pixels(
+                    state.dashboard_state.selected_point, state.coords.scale
+                )
+            )
+        return targets
+
     @staticmethod
     @inject_state
     def image_write(var: NtracerState):  # displays the annotation layer
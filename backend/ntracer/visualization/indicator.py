@@ -22,11 +22,7 @@ class IndicatorFunctions:
         state.endingPointS = action_state
 
         if no_mean_shift is False:
-            new_point = mean_shift(
-                action_state.mouse_voxel_coordinates,
-            state.cdn_url.geturl(),
-            state.dataset_id,
-            )
+            new_point = mean_shift(action_state.mouse_voxel_coordinates)
         else:
             new_point = action_state.mouse_voxel_coordinates
         
@@ -123,7 +119,7 @@ class IndicatorFunctions:
     @staticmethod
     def get_soma_annotation(coords: Coords, neuron_id: int, z_slices=None):
         lines = []
-        soma_nodes = coords.roots[neuron_id].soma_layers
+        soma_nodes = coords.roots.peek(neuron_id).soma_layers
 
         if z_slices is None:
             z_slices = soma_nodes.keys()
@@ -200,6 +200,11 @@ async def dashboard_state_update(request: Request):
         != dashboard_state.selected_display_channels
     ):
         channels_have_changed = True
+    if (
+        "selected_analysis_channels" in data
+        and data["selected_analysis_channels"] != dashboard_state.selected_analysis_channels
+    ):
+        state.mean_shift_memo.clear()
     if data["projection_range"] != dashboard_state.projection_range:
         projection_range_has_changed = True
     if data["expanded_neuron"] != dashboard_state.expanded_neuron:
@@ -231,7 +236,7 @@ async def dashboard_state_update(request: Request):
         if not isinstance(neuron, Neuron):
             raise TypeError("Cannot retrieve swc as Neuron object")
 
-        state.coords.roots[dashboard_state.expanded_neuron] = neuron
+        state.coords.load_neuron(dashboard_state.expanded_neuron, neuron)
         state.coords.downloaded_neurons.append(dashboard_state.expanded_neuron)
         # NtracerFunctions.set_selected_points()
 
@@ -476,7 +481,7 @@ async def export_swc(selected: bool):
     for (awaitable, neuron_id) in awaits:
         new_neuron = await awaitable
         if type(new_neuron) is Neuron:
-            state.coords.roots[neuron_id] = new_neuron
+            state.coords.load_neuron(neuron_id, new_neuron)
             state.coords.downloaded_neurons.append(neuron_id)
     
     out_bin = swc_helper.export_swc(neuron_ids)
@@ -508,6 +513,16 @@ def trace_soma():
             content={"success": False, "message": f"Error: {str(e)}"}
         )
 
+@app.get("/trace/cancel")
+def trace_cancel():
+    if TracingFunctions.cancel_trace():
+        return JSONResponse(
+            content={"success": True, "message": "Trace cancelled"}
+        )
+    return JSONResponse(
+        content={"success": False, "message": "No trace in progress"}
+    )
+
 @app.post("/swc/import")
 async def import_swc(request: Request):
     try:
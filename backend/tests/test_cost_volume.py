@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from algorithm.astar.cost_volume import CostVolumeCache, cost_volume
+
+AstarWrapper = pytest.importorskip("algorithm.astar.AstarWrapper").AstarWrapper
+
+
+def brainbow_tube(channels: int) -> tuple[np.ndarray, tuple, tuple]:
+    """Noisy multichannel volume with a bright tube along x
+
+    Returns:
+        volume, start, end
+    """
+    rng = np.random.default_rng(channels)
+    volume = rng.poisson(60, size=(60, 40, 20, channels)).astype(np.uint16)
+    volume[10:50, 20, 10, :3] = [3000, 800, 200]
+    return volume, (10, 20, 10), (49, 20, 10)
+
+
+@pytest.mark.parametrize("channels", [3, 4])
+def test_cached_multichannel_trace_matches_uncached(channels):
+    volume, start, end = brainbow_tube(channels)
+
+    cached = AstarWrapper(is_multi=True).get_trace(start, end, volume, cost_cache=CostVolumeCache())
+    uncached = AstarWrapper(is_multi=True).get_trace(start, end, volume)
+
+    assert cached == uncached
+
+
+def test_cost_volume_ignores_channels_past_the_third():
+    volume, _, _ = brainbow_tube(4)
+    base = [1000, 300, 100, 50]
+
+    costs = cost_volume(volume, base, is_multi=True)
+
+    np.testing.assert_array_equal(costs, cost_volume(volume[..., :3], base[:3], is_multi=True))
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+AstarWrapper = pytest.importorskip("algorithm.astar.AstarWrapper").AstarWrapper
+
+
+def line_volume() -> np.ndarray:
+    volume = np.full((40, 20, 10), 60, dtype=np.uint16)
+    volume[5:35, 10, 5] = 2000
+    return volume
+
+
+def test_traces_follow_the_get_trace_convention():
+    volume = line_volume()
+    start, end = (5, 10, 5), (30, 10, 5)
+
+    tracer = AstarWrapper()
+    (path,) = tracer.get_traces(start, [end], volume)
+
+    assert start not in path
+    assert path == AstarWrapper().get_trace(start, end, volume)
+
+
+def test_end_at_the_start_gives_an_empty_path():
+    volume = line_volume()
+    start = (5, 10, 5)
+
+    tracer = AstarWrapper()
+    paths = tracer.get_traces(start, [start, (20, 10, 5)], volume)
+
+    assert paths[0] == []
+    assert tracer.statuses[0] == "found"
+    assert tracer.costs[0] == 0
+    assert start not in paths[1]
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from cdn.point_encoding import POINTS_BINARY, decode_points, encode_points
+
+TRACE_TEXT = b"1,2,3\n4,5,6\n"
+
+
+@pytest.mark.parametrize("content_type", [None, "", "application/json", "application/octet-stream", "text/html; charset=utf-8"])
+def test_text_response_decodes_whatever_its_content_type(content_type):
+    np.testing.assert_array_equal(decode_points(TRACE_TEXT, content_type), [[1, 2, 3], [4, 5, 6]])
+
+
+@pytest.mark.parametrize("content_type", [None, "application/json"])
+def test_unlabelled_mean_shift_response_decodes(content_type):
+    assert decode_points(b"7,8,9", content_type)[0].tolist() == [7, 8, 9]
+
+
+def test_binary_round_trip():
+    data, content_type = encode_points([[1, 2, 3], [4, 5, 6]], POINTS_BINARY)
+
+    assert content_type == POINTS_BINARY
+    np.testing.assert_array_equal(decode_points(data, content_type), [[1, 2, 3], [4, 5, 6]])